@@ -186,6 +186,20 @@ DJANGO_TABLES2_TEMPLATE = "rainboard/tables.html"
 RAINBOARD_DATA = Path("/srv/dashboard")
 RAINBOARD_GITS = RAINBOARD_DATA / "repositories"
 RAINBOARD_RPKG = RAINBOARD_DATA / "robotpkg"
+RAINBOARD_API_CONCURRENCY = int(os.environ.get("RAINBOARD_API_CONCURRENCY", "8"))
+RAINBOARD_API_CACHE_SIZE = int(os.environ.get("RAINBOARD_API_CACHE_SIZE", "20000"))
+RAINBOARD_RATELIMIT_RESERVE = int(os.environ.get("RAINBOARD_RATELIMIT_RESERVE", "200"))
+RAINBOARD_GIT_CACHE_SIZE = int(os.environ.get("RAINBOARD_GIT_CACHE_SIZE", "32"))
+RAINBOARD_FETCH_JOBS = int(os.environ.get("RAINBOARD_FETCH_JOBS", "4"))
+RAINBOARD_FETCH_COMMIT_GRAPH = (
+    os.environ.get("RAINBOARD_FETCH_COMMIT_GRAPH", "False").lower() == "true"
+)
+RAINBOARD_GIT_BLOBLESS = (
+    os.environ.get("RAINBOARD_GIT_BLOBLESS", "False").lower() == "true"
+)
+RAINBOARD_RPKG_JOBS = int(
+    os.environ.get("RAINBOARD_RPKG_JOBS", str(os.cpu_count() or 1)),
+)
 PRIVATE_REGISTRY = "gitlab.laas.fr:4567"
 PUBLIC_REGISTRY = "memmos.laas.fr:5000"
 GITHUB_USER = "hrp2-14"
@@ -29,6 +29,7 @@ from gitlab import GitlabDeleteError
 
 from dashboard.middleware import ip_laas
 from rainboard.models import Namespace, Project
+from rainboard.ratelimit import WEBHOOK, priority
 from rainboard.utils import SOURCES
 
 from . import models
@@ -104,7 +105,7 @@ async def pull_request(request: HttpRequest, rep: str) -> HttpResponse:  # noqa:
 
     gh_remote_name = f"github/{login}"
     if gh_remote_name not in git_repo.remotes:
-        remote = await sync_to_async(git_repo.create_remote)(
+        remote = await sync_to_async(project.create_remote)(
             gh_remote_name,
             data["pull_request"]["head"]["repo"]["clone_url"],
         )
@@ -126,7 +127,7 @@ async def pull_request(request: HttpRequest, rep: str) -> HttpResponse:  # noqa:
         gl_remote_name = f"gitlab/{namespace.slug}"
         if gl_remote_name not in git_repo.remotes:
             url = await sync_to_async(project.remote_url_gitlab)()
-            await sync_to_async(git_repo.create_remote)(gl_remote_name, url=url)
+            await sync_to_async(project.create_remote)(gl_remote_name, url=url)
 
         await models.PushQueue.objects.acreate(
             namespace=namespace,
@@ -223,7 +224,7 @@ async def push(  # noqa: C901
         gl_remote = await sync_to_async(git_repo.remote)(gl_remote_name)
     else:
         url = await sync_to_async(project.remote_url_gitlab)()
-        gl_remote = await sync_to_async(git_repo.create_remote)(gl_remote_name, url=url)
+        gl_remote = await sync_to_async(project.create_remote)(gl_remote_name, url=url)
     gl_remote.fetch()
 
     # Fetch the latest commit from github
@@ -231,7 +232,7 @@ async def push(  # noqa: C901
         gh_remote = await sync_to_async(git_repo.remote)(gh_remote_name)
     else:
         url = await sync_to_async(project.remote_url_github)()
-        gh_remote = await sync_to_async(git_repo.create_remote)(gh_remote_name, url=url)
+        gh_remote = await sync_to_async(project.create_remote)(gh_remote_name, url=url)
     gh_remote.fetch()
 
     # The branch was deleted on one remote,
@@ -260,6 +261,7 @@ async def push(  # noqa: C901
         git_repo.heads[branch].commit = commit
     else:
         await sync_to_async(git_repo.create_head)(branch, commit=commit)
+    await sync_to_async(project.update_commits_since)()
 
     # Push the changes to other remote
     try:
@@ -404,12 +406,13 @@ async def webhook(request: HttpRequest) -> HttpResponse:
     event = request.headers.get("x-github-event", "ping")
     if event == "ping":
         return HttpResponse("pong")
-    if event == "push":
-        return await push(request, SOURCES.github, "push event detected")
-    if event == "check_suite":
-        return await check_suite(request, "check_suite event detected")
-    if event == "pull_request":
-        return await pull_request(request, "pull_request event detected")
+    with priority(WEBHOOK):
+        if event == "push":
+            return await push(request, SOURCES.github, "push event detected")
+        if event == "check_suite":
+            return await check_suite(request, "check_suite event detected")
+        if event == "pull_request":
+            return await pull_request(request, "pull_request event detected")
 
     return HttpResponseForbidden("event not found")
 
@@ -437,9 +440,10 @@ async def gl_webhook(request: HttpRequest) -> HttpResponse:
     event = request.headers.get("x-gitlab-event")
     if event == "ping":
         return HttpResponse("pong")
-    if event == "Pipeline Hook":
-        return await pipeline(request, "pipeline event detected")
-    if event == "Push Hook":
-        return await push(request, SOURCES.gitlab, "push event detected")
+    with priority(WEBHOOK):
+        if event == "Pipeline Hook":
+            return await pipeline(request, "pipeline event detected")
+        if event == "Push Hook":
+            return await push(request, SOURCES.gitlab, "push event detected")
 
     return HttpResponseForbidden("event not found")
@@ -41,5 +41,7 @@ for model in [
     models.ContributorName,
     models.ContributorMail,
     models.IssuePr,
+    models.UpdateRun,
+    models.UpdateTask,
 ]:
     admin.site.register(model)
@@ -0,0 +1,52 @@
+import time
+
+import git
+from django.core.management.base import BaseCommand
+
+from rainboard.models import Branch, Contributor, IdentityResolver, Project
+from rainboard.utils import parse_mailmap
+
+
+class Command(BaseCommand):
+    help = "Resolve the identities of the contributors of all projects at once"
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        authors, heads, mailmaps = {}, {}, []
+        for project in Project.objects.filter(main_namespace__isnull=False):
+            if not project.git_path().exists():
+                continue
+            try:
+                main = project.main_ref()
+                authors[project] = project.shortlog(main)
+                heads[project] = project.git().commit(main).hexsha
+            except (AttributeError, Branch.DoesNotExist, git.exc.GitCommandError):
+                self.stderr.write(f" {project}: no main branch")
+                continue
+            if (blob := project.main_blob(".mailmap")) is not None:
+                content = blob.data_stream.read().decode("utf-8", errors="replace")
+                mailmaps += parse_mailmap(content)
+        read = time.monotonic()
+        self.stdout.write(f"read {len(authors)} projects in {read - start:.1f}s")
+
+        pairs = [pair for project_pairs in authors.values() for pair in project_pairs]
+        resolved = IdentityResolver(pairs, mailmaps).save()
+        Contributor.projects.through.objects.bulk_create(
+            [
+                Contributor.projects.through(
+                    contributor=resolved[name],
+                    project=project,
+                )
+                for project, project_pairs in authors.items()
+                for name in {name for name, _ in project_pairs}
+            ],
+            ignore_conflicts=True,
+        )
+        # so that the next incremental updates only scan the new commits
+        for project, head in heads.items():
+            project.contributors_sha = head
+        Project.objects.bulk_update(heads, ["contributors_sha"])
+        self.stdout.write(
+            f"resolved {len(pairs)} authors into {Contributor.objects.count()} "
+            f"contributors in {time.monotonic() - read:.1f}s",
+        )
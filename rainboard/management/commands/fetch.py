@@ -1,8 +1,8 @@
 import logging
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from rainboard.models import Project
+from rainboard.models import FetchRun, Project, fetch_projects
 
 logger = logging.getLogger("rainboard.management.fetch")
 
@@ -10,8 +10,28 @@ logger = logging.getLogger("rainboard.management.fetch")
 class Command(BaseCommand):
     help = "Fetch all remotes"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="number of projects fetched in parallel",
+        )
+
     def handle(self, *args, **options):
-        logger.info("Fetching all repos")
-        for project in Project.objects.all():
-            logger.info(" updating branches for %s", project)
-            project.update_branches(main=False, pull=True)
+        projects = Project.objects.all()
+        with FetchRun(options["jobs"]):
+            logger.info("Fetching all repos")
+            errors = fetch_projects(projects, options["jobs"])
+            for project in projects:
+                if project in errors:
+                    continue
+                logger.info(" updating branches for %s", project)
+                project.update_branches(main=False, pull=True)
+                project.update_commits_since()
+        if errors:
+            self.stderr.write(f"\n{len(errors)} failures:\n")
+            for project, error in errors.items():
+                self.stderr.write(f" fetch {project}: {error!r}")
+            msg = f"{len(errors)} fetches failed"
+            raise CommandError(msg)
@@ -0,0 +1,78 @@
+import time
+
+import git
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rainboard.models import Project, set_blobless
+
+
+def prune(project, git_repo):
+    project.prune_remotes()
+
+
+def blobless(project, git_repo):
+    """
+    Turn the existing remotes into blobless promisors, if RAINBOARD_GIT_BLOBLESS.
+
+    Only the next fetches skip blobs: those already fetched are kept until the
+    repository is cloned again.
+    """
+    if settings.RAINBOARD_GIT_BLOBLESS:
+        for remote in git_repo.remotes:
+            set_blobless(remote)
+
+
+def commit_graph(project, git_repo):
+    """Write an incremental commit-graph, with generation numbers."""
+    git_repo.git.commit_graph("write", "--reachable", "--split", "--changed-paths")
+
+
+def repack(project, git_repo):
+    """
+    Repack geometrically, with a multi-pack index and its bitmap.
+
+    git may refuse to repack geometrically with promisor remotes, so only the
+    loose objects of blobless repositories are packed.
+    """
+    geometric = [] if settings.RAINBOARD_GIT_BLOBLESS else ["--geometric=2"]
+    git_repo.git.repack("-d", *geometric, "--write-midx", "--write-bitmap-index")
+
+
+STEPS = {
+    "prune": prune,
+    "blobless": blobless,
+    "commit-graph": commit_graph,
+    "repack": repack,
+}
+
+
+class Command(BaseCommand):
+    help = "Prune, write commit-graphs and repack the git repositories of projects"
+
+    def add_arguments(self, parser):
+        parser.add_argument("projects", nargs="*", help="slugs, defaults to all")
+
+    def handle(self, *args, **options):
+        projects = Project.objects.filter(main_namespace__isnull=False)
+        if options["projects"]:
+            projects = projects.filter(slug__in=options["projects"])
+        totals = dict.fromkeys(STEPS, 0.0)
+        for project in projects:
+            if not project.git_path().exists():
+                continue
+            git_repo = project.git()
+            timings = []
+            for step, func in STEPS.items():
+                start = time.monotonic()
+                try:
+                    func(project, git_repo)
+                except git.exc.GitCommandError as e:
+                    self.stderr.write(f" {project}: {step} failed: {e.stderr.strip()}")
+                duration = time.monotonic() - start
+                totals[step] += duration
+                timings.append(f"{step} {duration:.1f}s")
+            self.stdout.write(f" {project}: {', '.join(timings)}")
+        self.stdout.write(
+            "total: " + ", ".join(f"{s} {d:.1f}s" for s, d in totals.items()),
+        )
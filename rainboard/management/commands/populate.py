@@ -16,6 +16,13 @@ logger = logging.getLogger("rainboard.management.populate")
 class Command(BaseCommand):
     help = "populates licenses, projets, namespaces and repos from forges"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="crawl all projects of the forges, not only the recently active ones",
+        )
+
     def handle(self, *args, **options):
         logger.info("updating licenses")
         for data in httpx.get(LICENSES).json()["licenses"]:
@@ -27,7 +34,7 @@ class Command(BaseCommand):
         logger.info("updating forges")
         for forge in Forge.objects.order_by("source"):
             logger.info(" updating %s", forge)
-            forge.get_projects()
+            forge.get_projects(full=options["full"])
 
         logger.info("updating repos")
         for repo in Repo.objects.all():
@@ -1,4 +1,3 @@
-import itertools
 import logging
 
 from autoslug.utils import slugify
@@ -13,6 +12,7 @@ from rainboard.models import (
     update_github,
     update_gitlab,
 )
+from rainboard.utils import robotpkg_index
 
 
 class Command(BaseCommand):
@@ -56,19 +56,15 @@ class Command(BaseCommand):
 
         project = Project.objects.get(slug=slug)
 
-        for slug in [project.slug, project.slug.replace("_", "-")]:
-            for pkg in itertools.chain(
-                path.glob(f"*/{slug}{project.suffix}"),
-                path.glob(f"*/py-{slug}{project.suffix}"),
-            ):
-                obj, created = Robotpkg.objects.get_or_create(
-                    name=pkg.name,
-                    category=pkg.parent.name,
-                    project=project,
-                )
-                if created:
-                    logger.warning("found on robotpkg %s", obj)
-                    obj.update(pull=False)
+        for category, name in project.find_robotpkgs(robotpkg_index(path), ros2=False):
+            obj, created = Robotpkg.objects.get_or_create(
+                name=name,
+                category=category,
+                project=project,
+            )
+            if created:
+                logger.warning("found on robotpkg %s", obj)
+                obj.update(pull=False)
 
         for rpkg in project.robotpkg_set.all():
             logger.warning("updating images for %s", rpkg)
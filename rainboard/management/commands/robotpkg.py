@@ -1,11 +1,10 @@
-import itertools
 import logging
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 
-from rainboard.models import Project, Robotpkg
-from rainboard.utils import update_robotpkg
+from rainboard.models import Project, Robotpkg, update_robotpkgs
+from rainboard.utils import robotpkg_index, update_robotpkg
 
 logger = logging.getLogger("rainboard.robotpkg")
 
@@ -13,24 +12,33 @@ logger = logging.getLogger("rainboard.robotpkg")
 class Command(BaseCommand):
     help = "Populate database with Robotpkg data"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="number of packages introspected in parallel",
+        )
+
     def handle(self, *args, **options):
         path = settings.RAINBOARD_RPKG
 
         logger.info("Pulling Robotpkg repositories")
         update_robotpkg(path)
 
+        found = []
+        index = robotpkg_index(path)
         for project in Project.objects.all():
-            for slug in [project.slug, project.slug.replace("_", "-")]:
-                for pkg in itertools.chain(
-                    path.glob(f"*/{slug}{project.suffix}"),
-                    path.glob(f"*/py-{slug}{project.suffix}"),
-                    path.glob(f"*/{slug}{project.suffix}-ros2"),
-                ):
-                    obj, created = Robotpkg.objects.get_or_create(
-                        name=pkg.name,
-                        category=pkg.parent.name,
-                        project=project,
-                    )
-                    if created:
-                        logger.info("%s found in %s", project, pkg)
-                        obj.update(pull=False)
+            for category, name in project.find_robotpkgs(index):
+                obj, created = Robotpkg.objects.get_or_create(
+                    name=name,
+                    category=category,
+                    project=project,
+                )
+                if created:
+                    logger.info("%s found in %s/%s", project, category, name)
+                    found.append(obj)
+
+        logger.info("Updating %s new packages", len(found))
+        for robotpkg in update_robotpkgs(found, options["jobs"]):
+            robotpkg.update_images()
@@ -1,15 +1,30 @@
 import re
+from collections import defaultdict
 from datetime import timedelta
+from functools import partial
 
 from django.conf import settings
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import F, Q
 from django.utils import timezone
 
 import github
 
-from rainboard.models import Branch, Forge, Image, IssuePr, Project, Repo, Robotpkg
+from rainboard import workers
+from rainboard.models import (
+    Branch,
+    FetchRun,
+    Forge,
+    Image,
+    IssuePr,
+    Project,
+    Repo,
+    Robotpkg,
+    UpdateRun,
+    UpdateTask,
+    update_robotpkgs,
+)
 from rainboard.utils import SOURCES, update_robotpkg
 
 # Only show issues and pull requests older than this
@@ -60,44 +75,167 @@ def update_issues_pr():
         issue_pr.update(SKIP_LABEL)
 
 
+def call(instance, method, **kwargs):
+    """Call a method on a fresh copy of instance, unless it was deleted since."""
+
+    def func():
+        fresh = type(instance).objects.filter(pk=instance.pk).first()
+        if fresh is not None:
+            getattr(fresh, method)(**kwargs)
+
+    return func
+
+
+def update_images(robotpkg, errors):
+    """Update the images of robotpkg, or raise the error of its introspection."""
+    update = call(robotpkg, "update_images")
+
+    def func():
+        if robotpkg.pk in errors:
+            raise errors[robotpkg.pk]
+        update()
+
+    return func
+
+
+def crawl_graph(crawl, full):
+    """Add the issues, forges and contributors updates to the crawl graph."""
+    crawl.add("issues and pull requests", update_issues_pr, key="issues")
+    for forge in Forge.objects.order_by("source"):
+        crawl.add(
+            f"crawl {forge}",
+            call(forge, "get_projects", full=full),
+            key=f"forge {forge.pk}",
+        )
+    for project in Project.objects.from_gepetto():
+        crawl.add(
+            f"contributors {project}",
+            call(project, "update_contributors"),
+            project.pk,
+            key=f"contributors {project.pk}",
+        )
+    return crawl
+
+
 class Command(BaseCommand):
     help = "Update the DB"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="crawl all projects of the forges, not only the recently active ones",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="number of projects updated in parallel",
+        )
+        parser.add_argument(
+            "--resume",
+            type=int,
+            metavar="MINUTES",
+            help="skip the updates which succeeded in the last MINUTES",
+        )
+
     def handle(self, *args, **options):
         def log(message):
             self.stdout.write(message)
 
-        log("\nUpdating all repos\n")
+        done = []
+        if options["resume"]:
+            done = UpdateTask.objects.passed_since(options["resume"]).values_list(
+                "key",
+                flat=True,
+            )
+        update_run = UpdateRun.objects.create()
+        graph = workers.Graph(log, update_run, done)
+        repos, rpkgs = defaultdict(list), defaultdict(list)
+
+        log("\nRunning update tasks\n")
+        pull = graph.add(
+            "pull robotpkg",
+            partial(update_robotpkg, settings.RAINBOARD_RPKG),
+            key="robotpkg",
+        )
         for repo in Repo.objects.filter(
             project__archived=False,
             project__main_namespace__from_gepetto=True,
-        ):
-            log(f" {repo}")
-            repo.update()
+        ).select_related("project", "forge", "namespace"):
+            repos[repo.project_id].append(
+                graph.add(
+                    str(repo),
+                    call(repo, "update"),
+                    repo.project_id,
+                    key=f"repo {repo.pk}",
+                ),
+            )
 
-        log("\nUpdating all branches\n")
-        for branch in Branch.objects.filter(
+        robotpkgs = Robotpkg.objects.filter(
             project__archived=False,
             project__main_namespace__from_gepetto=True,
-        ):
-            log(f" {branch.project} - {branch}")
-            branch.update(pull=False)
-
-        log("\nPulling Robotpkg\n")
-        update_robotpkg(settings.RAINBOARD_RPKG)
+        )
+        rpkg_errors = {}
+        introspect = graph.add(
+            "robotpkg packages",
+            partial(update_robotpkgs, robotpkgs, errors=rpkg_errors),
+            after=[pull],
+            key="robotpkg packages",
+        )
+        for robotpkg in robotpkgs:
+            rpkgs[robotpkg.project_id].append(
+                graph.add(
+                    f"robotpkg {robotpkg}",
+                    update_images(robotpkg, rpkg_errors),
+                    robotpkg.project_id,
+                    after=[introspect],
+                    key=f"robotpkg {robotpkg.pk}",
+                ),
+            )
 
-        log("\nUpdating gepetto projects\n")
         for project in Project.objects.from_gepetto():
-            log(f" {project}")
-            project.update(only_main_branches=False)
+            branches = graph.add(
+                f"branches {project}",
+                call(project, "update_branches", main=False, pull=False),
+                project.pk,
+                after=repos[project.pk],
+                key=f"branches {project.pk}",
+            )
+            ahead_behind = graph.add(
+                f"ahead / behind {project}",
+                call(project, "update_ahead_behind"),
+                project.pk,
+                after=[branches],
+                key=f"ahead behind {project.pk}",
+            )
+            update = graph.add(
+                f"project {project}",
+                call(project, "update", metadata=False, branches=False),
+                project.pk,
+                after=[pull, ahead_behind, *rpkgs[project.pk]],
+                key=f"project {project.pk}",
+            )
+            graph.add(
+                f"cmake / ros {project}",
+                call(project, "update_metadata"),
+                project.pk,
+                after=[update],
+                key=f"metadata {project.pk}",
+            )
 
-        log("\nUpdating Robotpkg\n")
-        for robotpkg in Robotpkg.objects.filter(
-            project__archived=False,
-            project__main_namespace__from_gepetto=True,
-        ):
-            log(f" {robotpkg}")
-            robotpkg.update(pull=False)
+        with FetchRun():
+            graph.run(options["jobs"])
+        graph.report()
+
+        # These save whole Project rows, or share Contributor rows between
+        # projects, so they must not run along the rest
+        log("\nUpdating issues, contributors and crawling forges\n")
+        crawl = crawl_graph(workers.Graph(log, update_run, done), options["full"])
+        crawl.run(1)
+        update_run.finished = timezone.now()
+        update_run.save()
 
         log("\nUpdating keep doc\n")
         Branch.objects.filter(
@@ -118,9 +256,9 @@ class Command(BaseCommand):
         ):
             log(f" {img}")
 
-        update_issues_pr()
-
-        log("updating forges")
-        for forge in Forge.objects.order_by("source"):
-            log(f" updating {forge}")
-            forge.get_projects()
+        if errors := graph.errors() + crawl.errors():
+            self.stderr.write(f"\n{len(errors)} failures:\n")
+            for label, error in errors:
+                self.stderr.write(f" {label}: {error!r}")
+            msg = f"{len(errors)} updates failed"
+            raise CommandError(msg)
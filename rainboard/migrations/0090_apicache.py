@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0089_rip_2004"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ApiCache",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url", models.URLField(max_length=500, unique=True)),
+                ("etag", models.CharField(blank=True, default="", max_length=200)),
+                (
+                    "last_modified",
+                    models.CharField(blank=True, default="", max_length=50),
+                ),
+                ("headers", models.JSONField(default=dict)),
+                ("content", models.BinaryField()),
+                ("used", models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0090_apicache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forge",
+            name="crawled",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
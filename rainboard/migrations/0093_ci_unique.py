@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:23
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def deduplicate(apps, schema_editor):
+    for model, field in (("CIBuild", "build_id"), ("CIJob", "job_id")):
+        Model = apps.get_model("rainboard", model)
+        duplicates = (
+            Model.objects.values("repo", field)
+            .annotate(count=Count("id"), last=Max("id"))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates:
+            Model.objects.filter(
+                repo=duplicate["repo"],
+                **{field: duplicate[field]},
+            ).exclude(id=duplicate["last"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0092_updaterun"),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="cibuild",
+            unique_together={("repo", "build_id")},
+        ),
+        migrations.AlterUniqueTogether(
+            name="cijob",
+            unique_together={("repo", "job_id")},
+        ),
+    ]
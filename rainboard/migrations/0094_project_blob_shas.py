@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0093_ci_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="cmakelists_sha",
+            field=models.CharField(blank=True, default="", max_length=40),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="package_xml_sha",
+            field=models.CharField(blank=True, default="", max_length=40),
+        ),
+    ]
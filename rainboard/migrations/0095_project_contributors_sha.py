@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0094_project_blob_shas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="contributors_sha",
+            field=models.CharField(blank=True, default="", max_length=40),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0095_project_contributors_sha"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="commits_since",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="commits_since_key",
+            field=models.CharField(blank=True, default="", max_length=81),
+        ),
+    ]
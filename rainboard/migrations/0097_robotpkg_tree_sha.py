@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0096_project_commits_since"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="robotpkg",
+            name="tree_sha",
+            field=models.CharField(blank=True, default="", max_length=81),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+def reintrospect(apps, schema_editor):
+    """Forget the tree SHAs, so that the next update reads the dependencies."""
+    apps.get_model("rainboard", "Robotpkg").objects.update(tree_sha="")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("rainboard", "0097_robotpkg_tree_sha"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="robotpkg",
+            name="depends",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(reintrospect, migrations.RunPython.noop),
+    ]
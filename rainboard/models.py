@@ -1,8 +1,21 @@
+import asyncio
+import atexit
 import hashlib
+import itertools
 import json
 import logging
+import multiprocessing
 import re
-from subprocess import check_output
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from contextlib import nullcontext
+from datetime import timedelta
 
 import git
 import httpx
@@ -21,7 +34,19 @@ from gitlab import Gitlab
 from ndh.models import Links, NamedModel, TimeStampedModel
 from ndh.utils import query_sum
 
-from .utils import SOURCES, api_next, invalid_mail, slugify_with_dots, valid_name
+from . import workers
+from .ratelimit import ScheduledSession, get_scheduler
+from .utils import (
+    SOURCES,
+    UnionFind,
+    api_last,
+    api_next,
+    introspect_robotpkg,
+    invalid_mail,
+    slugify_with_dots,
+    topological_levels,
+    valid_name,
+)
 
 logger = logging.getLogger("rainboard.models")
 
@@ -47,6 +72,16 @@ RPKG_FIELDS = [
     "COMMENT",
     "HOMEPAGE",
 ]
+RPKG_VARNAMES = [*RPKG_FIELDS, "LICENSE", "RESTRICTED"]
+RPKG_UPDATE_FIELDS = [
+    "tree_sha",
+    *(field.lower() for field in RPKG_FIELDS),
+    "updated",
+    "license",
+    "public",
+    "description",
+    "depends",
+]
 CMAKE_FIELDS = {
     "NAME": "cmake_name",
     "DESCRIPTION": "description",
@@ -77,6 +112,47 @@ GEPETTO_SLUGS = [
     "loco-3d",
     "simple-robotics",
 ]
+GITHUB_REPOS_QUERY = """
+query($org: String!, $cursor: String) {
+  organization(login: $org) {
+    repositories(
+      first: 100
+      after: $cursor
+      orderBy: { field: PUSHED_AT, direction: DESC }
+    ) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId
+        name
+        url
+        homepageUrl
+        description
+        isArchived
+        pushedAt
+        defaultBranchRef { name }
+        licenseInfo { spdxId }
+        parent { databaseId parent { databaseId parent { databaseId isFork } } }
+        issues(states: OPEN) { totalCount }
+        pullRequests(states: OPEN) { totalCount }
+      }
+    }
+  }
+}
+"""
+API_CACHE_HEADERS = [
+    "Content-Type",
+    "Link",
+    "X-Next-Page",
+    "X-Page",
+    "X-Total",
+    "X-Total-Pages",
+]
+# Check the size of the API cache once every so many insertions
+API_CACHE_EVICT_EVERY = 100
+API_CACHE_INSERTS = itertools.count(1)
+HTTP_CLIENTS = {}
+HTTP_CLIENTS_LOCK = threading.Lock()
+GIT_REPOS = threading.local()
 
 
 class Namespace(NamedModel):
@@ -107,37 +183,73 @@ class Forge(Links, NamedModel):
     url = models.URLField(max_length=200)
     token = models.CharField(max_length=50, blank=True)
     verify = models.BooleanField(default=True)
+    crawled = models.DateTimeField(blank=True, null=True)
 
     def get_absolute_url(self):
         return self.url
 
+    def client(self):
+        return get_client(f"forge-{self.pk}", verify=self.verify)
+
+    def scheduler(self):
+        return get_scheduler(self.api_url())
+
+    def api_get(self, url, page=1):
+        """GET an API url, as a conditional request if its response is cached."""
+        key = api_cache_key(url, page)
+        headers = {**self.headers(), **api_cache_conditions([key]).get(key, {})}
+        scheduler = self.scheduler()
+        while True:
+            scheduler.acquire()
+            req = self.client().get(key, headers=headers)
+            if scheduler.update_from(req):
+                continue
+            if (response := api_cache_response(key, req)) is not None:
+                return response
+            # the cached response was evicted since its conditions were read
+            headers = self.headers()
+
     def api_req(self, url="", name=None, page=1):
         logger.debug("requesting api %s %s, page %d", self, url, page)
         try:
-            return httpx.get(
-                self.api_url() + url,
-                params={"page": page},
-                verify=self.verify,
-                headers=self.headers(),
-            )
+            return self.api_get(self.api_url() + url, page)
         except httpx.HTTPError:
             logger.error("requesting api %s %s, page %d - SECOND TRY", self, url, page)
-            return httpx.get(
-                self.api_url() + url,
-                params={"page": page},
-                verify=self.verify,
-                headers=self.headers(),
-            )
+            return self.api_get(self.api_url() + url, page)
 
     def api_data(self, url=""):
         req = self.api_req(url)
         return req.json() if req.status_code == 200 else []  # TODO
 
-    def api_list(self, url="", name=None, limit=None):
-        page = 1
+    def api_graphql(self, query, **variables):
+        url = f"{self.api_url()}/graphql"
+        logger.debug("requesting graphql api %s %s", self, variables)
+        scheduler = get_scheduler(url)
+        while True:
+            scheduler.acquire()
+            req = self.client().post(
+                url,
+                json={"query": query, "variables": variables},
+                headers=self.headers(),
+            )
+            if not scheduler.update_from(req):
+                break
+        if req.status_code != 200:
+            logger.error("graphql api %s %s: %s", self, variables, req.text)
+            return None
+        data = req.json()
+        if "errors" in data:
+            logger.error("graphql api %s %s: %s", self, variables, data["errors"])
+        return data.get("data")
+
+    def api_list(self, url="", name=None, limit=None, concurrency=None, strict=False):
+        """Iterate over the items of all the pages of an API listing."""
+        page, reqs = 1, []
         while page:
-            req = self.api_req(url, name, page)
+            req = reqs.pop(0) if reqs else self.api_req(url, name, page)
             if req.status_code != 200:
+                if strict:
+                    req.raise_for_status()
                 return []  # TODO
             data = req.json()
             if name is not None:
@@ -146,6 +258,8 @@ class Forge(Links, NamedModel):
             page = api_next(self.source, req)
             if limit is not None and page is not None and page > limit:
                 break
+            if concurrency and page == 2:
+                reqs = api_gather(self, self.api_url() + url, req, limit, concurrency)
 
     def headers(self):
         return {
@@ -203,21 +317,59 @@ class Forge(Links, NamedModel):
     def get_namespaces_travis(self):
         pass
 
-    def get_projects(self):
+    def get_projects(self, full=False):
+        """Crawl the forge for projects, since the last crawl unless full."""
+        started = timezone.now()
+        since = None if full else self.crawled
         getattr(self, f"get_namespaces_{self.get_source_display().lower()}")()
-        return getattr(self, f"get_projects_{self.get_source_display().lower()}")()
+        # raises if a page could not be fetched, so that it is crawled again
+        getattr(self, f"get_projects_{self.get_source_display().lower()}")(since)
+        self.crawled = started
+        self.save(update_fields=["crawled"])
 
-    def get_projects_github(self):
+    def get_projects_github(self, since=None):
+        failed = []
         for org in Namespace.objects.filter(group=True):
-            for data in self.api_list(f"/orgs/{org.slug}/repos"):
-                update_github(self, org, data)
+            cursor = None
+            while cursor is not False:
+                res = self.api_graphql(GITHUB_REPOS_QUERY, org=org.slug, cursor=cursor)
+                if res is None:
+                    failed.append(org.slug)
+                if not res or not res["organization"]:
+                    break
+                repositories = res["organization"]["repositories"]
+                cursor = (
+                    repositories["pageInfo"]["hasNextPage"]
+                    and repositories["pageInfo"]["endCursor"]
+                )
+                for node in repositories["nodes"]:
+                    pushed = node["pushedAt"] and parse_datetime(node["pushedAt"])
+                    if since is not None and (not pushed or pushed < since):
+                        cursor = False
+                        break
+                    data = github_graphql_repo(node)
+                    update_github(self, org, data, repo_data=data)
+        if failed:
+            msg = f"could not crawl the repositories of {', '.join(failed)}"
+            raise ValueError(msg)
         # for user in Namespace.objects.filter(group=False):
         # for data in self.api_list(f"/users/{user.slug}/repos"):
         # if Project.objects.filter(name=valid_name(data["name"])).exists():
         # update_github(self, user, data)
 
-    def get_projects_gitlab(self):
-        for data in self.api_list("/projects"):
+    def get_projects_gitlab(self, since=None):
+        url = "/projects"
+        if since is not None:
+            params = httpx.QueryParams(
+                order_by="last_activity_at",
+                last_activity_after=since.isoformat(),
+            )
+            url += f"?{params}"
+        for data in self.api_list(
+            url,
+            concurrency=settings.RAINBOARD_API_CONCURRENCY,
+            strict=True,
+        ):
             update_gitlab(self, data)
 
         for orphan in Project.objects.filter(main_namespace=None).exclude(
@@ -227,10 +379,10 @@ class Forge(Links, NamedModel):
             if repo:
                 update_gitlab(self, self.api_data(f"/projects/{repo.forked_from}"))
 
-    def get_projects_redmine(self):
+    def get_projects_redmine(self, since=None):
         pass
 
-    def get_projects_travis(self):
+    def get_projects_travis(self, since=None):
         for namespace in Namespace.objects.all():
             for repository in self.api_list(
                 f"/owner/{namespace.slug}/repos",
@@ -240,6 +392,79 @@ class Forge(Links, NamedModel):
                     update_travis(namespace, repository)
 
 
+class ApiCache(models.Model):
+    """Forge API response, kept to send conditional requests."""
+
+    url = models.URLField(max_length=500, unique=True)
+    etag = models.CharField(max_length=200, blank=True, default="")
+    last_modified = models.CharField(max_length=50, blank=True, default="")
+    headers = models.JSONField(default=dict)
+    content = models.BinaryField()
+    used = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.url
+
+    def conditions(self):
+        ret = {}
+        if self.etag:
+            ret["If-None-Match"] = self.etag
+        if self.last_modified:
+            ret["If-Modified-Since"] = self.last_modified
+        return ret
+
+
+class UpdateRun(models.Model):
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ("-started",)
+
+    def __str__(self):
+        return f"update {self.pk} - {self.started:%Y-%m-%d %H:%M}"
+
+    def track(self, key, label, func):
+
+        def tracked():
+            task = self.updatetask_set.create(key=key, label=label)
+            try:
+                func()
+            except Exception as e:
+                task.passed, task.error = False, repr(e)
+                raise
+            else:
+                task.passed = True
+            finally:
+                task.finished = timezone.now()
+                task.save()
+
+        return tracked
+
+
+class UpdateTaskQuerySet(models.QuerySet):
+    def passed_since(self, minutes):
+        return self.filter(
+            passed=True,
+            finished__gte=timezone.now() - timedelta(minutes=minutes),
+        )
+
+
+class UpdateTask(models.Model):
+    run = models.ForeignKey(UpdateRun, on_delete=models.CASCADE)
+    key = models.CharField(max_length=200, db_index=True)
+    label = models.CharField(max_length=500)
+    passed = models.BooleanField(null=True)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+
+    objects = UpdateTaskQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.run_id} / {self.label}"
+
+
 class ProjectQuerySet(models.QuerySet):
     def from_gepetto(self):
         """Consider only our active and maintained projects."""
@@ -288,6 +513,11 @@ class Project(Links, NamedModel, TimeStampedModel):
     clang_args = models.CharField(max_length=200, blank=True, default="")
     slug_us = AutoSlugField(populate_from="slug", unique=True)
     ignore = models.BooleanField(default=False)
+    cmakelists_sha = models.CharField(max_length=40, blank=True, default="")
+    package_xml_sha = models.CharField(max_length=40, blank=True, default="")
+    contributors_sha = models.CharField(max_length=40, blank=True, default="")
+    commits_since = models.PositiveIntegerField(blank=True, null=True)
+    commits_since_key = models.CharField(max_length=81, blank=True, default="")
 
     objects = ProjectQuerySet.as_manager()
 
@@ -315,17 +545,25 @@ class Project(Links, NamedModel, TimeStampedModel):
         path = self.git_path()
         if not path.exists():
             logger.info("Creating repo for %s/%s", self.main_namespace.slug, self.slug)
-            return git.Repo.init(path)
-        return git.Repo(str(path / ".git"))
+            return get_git(path, init=True)
+        return get_git(path)
 
     def github(self):
         github_forge = Forge.objects.get(slug="github")
+        scheduler = github_forge.scheduler()
+        scheduler.acquire()
         gh = Github(github_forge.token)
-        return gh.get_repo(f"{self.main_namespace.slug_github}/{self.slug_us}")
+        repo = gh.get_repo(f"{self.main_namespace.slug_github}/{self.slug_us}")
+        scheduler.update(gh.rate_limiting[0], gh.rate_limiting_resettime)
+        return repo
 
     def gitlab(self):
         gitlab_forge = Forge.objects.get(slug="gitlab")
-        gl = Gitlab(gitlab_forge.url, private_token=gitlab_forge.token)
+        gl = Gitlab(
+            gitlab_forge.url,
+            private_token=gitlab_forge.token,
+            session=ScheduledSession(gitlab_forge.scheduler()),
+        )
         return gl.projects.get(f"{self.main_namespace.slug_gitlab}/{self.slug_us}")
 
     def main_repo(self):
@@ -340,60 +578,234 @@ class Project(Links, NamedModel, TimeStampedModel):
             repo.api_update()
         return repo
 
-    def update_branches(self, main=True, pull=True):
-        branches = [
-            b[2:] for b in self.git().git.branch("-a", "--no-color").split("\n")
-        ]
+    def git_refs(self):
+        """Get ({branch: (sha, date)}, {tag: sha}) from the remote-tracking refs."""
+        branches, tags = {}, {}
+        for line in (
+            self.git()
+            .git.for_each_ref(
+                "--format=%(refname) %(objectname) %(authordate:iso-strict)",
+                "refs/remotes/",
+                "refs/tags/",
+            )
+            .splitlines()
+        ):
+            ref, sha, date = line.split(" ")
+            if ref.startswith("refs/tags/"):
+                tags[ref.removeprefix("refs/tags/")] = sha
+            elif not ref.endswith("/HEAD"):
+                name = ref.removeprefix("refs/remotes/")
+                branches[name] = (sha, parse_datetime(date) if date else None)
+        return branches, tags
+
+    def update_branches(self, main=True, pull=True, refs=None):
+        """Sync the branches of the DB with the git repository."""
+        if refs is None:
+            refs, _ = self.git_refs()
+        branches = {branch.name: branch for branch in self.branch_set.all()}
         if main:
-            branches = [
-                b for b in branches if any(b.endswith(main) for main in MAIN_BRANCHES)
-            ]
-        for branch in branches:
-            logger.info("update branch %s", branch)
-            if branch.startswith("remotes/"):
-                branch = branch[8:]
-            if branch.count("/") < 2:
-                if branch not in ["main", "master"]:
-                    logger.error('wrong branch "%s" in %s', branch, self.git_path())
-                continue
-            forge, namespace, _name = branch.split("/", maxsplit=2)
-            namespace, _ = Namespace.objects.get_or_create(
+            refs = {name: ref for name, ref in refs.items() if is_main_branch(name)}
+            branches = {
+                name: branch
+                for name, branch in branches.items()
+                if is_main_branch(name)
+            }
+        repos = {}
+        new, changed = [], []
+        for name, (_sha, date) in refs.items():
+            if name in branches:
+                branch = branches[name]
+                if date is not None and branch.updated != date:
+                    branch.updated = date
+                    changed.append(branch)
+            elif (repo := self.branch_repo(name, repos)) is not None:
+                logger.info("new branch %s", name)
+                new.append(Branch(name=name, project=self, repo=repo, updated=date))
+        for name in branches.keys() - refs.keys():
+            if not branches[name].deleted:
+                branches[name].deleted = True
+                changed.append(branches[name])
+        Branch.objects.bulk_update(changed, ["updated", "deleted"])
+        self.add_branches(new, pull)
+
+    def add_branches(self, branches, pull=True):
+        branches = Branch.objects.bulk_create(branches)
+        if not branches:
+            return
+        if pull:
+            self.fetch()
+        self.update_ahead_behind(branches)
+
+    def branch_repo(self, name, repos):
+        """Get or create the Repo of a branch "forge/namespace/name", if valid."""
+        if name.count("/") < 2:
+            if name not in ["main", "master"]:
+                logger.error('wrong branch "%s" in %s', name, self.git_path())
+            return None
+        forge, namespace, _name = name.split("/", maxsplit=2)
+        if (forge, namespace) not in repos:
+            try:
+                forge_instance = Forge.objects.get(slug=forge)
+            except Forge.DoesNotExist:
+                logger.error('wrong branch "%s" in %s', name, self.git_path())
+                repos[forge, namespace] = None
+                return None
+            namespace_instance, _ = Namespace.objects.get_or_create(
                 slug=slugify(namespace),
                 defaults={"name": namespace},
             )
-            try:
-                forge = Forge.objects.get(slug=forge)
-            except Forge.DoesNotExist:
-                logger.error('wrong branch "%s" in %s', branch, self.git_path())
-                continue
             repo, created = Repo.objects.get_or_create(
-                forge=forge,
-                namespace=namespace,
+                forge=forge_instance,
+                namespace=namespace_instance,
                 project=self,
                 defaults={"name": self.name, "default_branch": "master", "repo_id": 0},
             )
             if created:
                 repo.api_update()
-            instance, bcreated = Branch.objects.get_or_create(
-                name=branch,
-                project=self,
-                repo=repo,
-            )
-            if bcreated:
-                instance.update(pull=pull)
+            repos[forge, namespace] = repo
+        return repos[forge, namespace]
+
+    def fetch(self):
+        """Fetch all the remotes at once, and return those which failed."""
+        run = FetchRun.active
+        if run is not None:
+            with run.lock:
+                future = run.fetched.get(self.pk)
+                owner = future is None
+                if owner:
+                    future = run.fetched[self.pk] = Future()
+            if not owner:
+                return future.result()
+        try:
+            for repo in self.repo_set.all():
+                repo.git()
+            git_repo = self.git()
+            failed = self.fetch_remotes(git_repo, [r.name for r in git_repo.remotes])
+            if failed:
+                logger.warning("fetching %s: %s - SECOND TRY", self, " ".join(failed))
+                failed = self.fetch_remotes(git_repo, sorted(failed))
+        except Exception as e:
+            if run is not None:
+                future.set_exception(e)
+            raise
+        if run is not None:
+            future.set_result(failed)
+        return failed
+
+    def fetch_remotes(self, git_repo, remotes):
+        """Fetch some remotes, and return those which failed."""
+        if not remotes:
+            return set()
+        logger.debug("fetching %s: %s", self, " ".join(remotes))
+        run = FetchRun.active
+        try:
+            options = ["--multiple", "--prune"]
+            if settings.RAINBOARD_FETCH_COMMIT_GRAPH:
+                options.append("--write-commit-graph")
+            with nullcontext() if run is None else run.semaphore:
+                git_repo.git.fetch(*options, *remotes)
+        except git.exc.GitCommandError as e:
+            if len(remotes) == 1:
+                return set(remotes)
+            failed = set(re.findall(r"could not fetch '?([^'\s]+)", e.stderr))
+            if not failed & set(remotes):
+                logger.error("fetching %s: %s", self, e.stderr.strip())
+            return failed & set(remotes)
+        return set()
+
+    def prune_remotes(self):
+        """Prune deleted branches and unused remotes, and return the removed ones."""
+        git_repo = self.git()
+        repos = {repo.git_remote() for repo in self.repo_set.select_related()}
+        removed = []
+        for remote in git_repo.remotes:
+            try:
+                git_repo.git.remote("prune", remote.name)
+            except git.exc.GitCommandError:
+                logger.warning("%s: can't reach remote %s", self, remote.name)
+                if remote.name in repos:
+                    continue
+            else:
+                if remote.name in repos or remote.refs:
+                    continue
+            git_repo.delete_remote(remote)
+            removed.append(remote.name)
+        return removed
 
-    def checkout(self):
-        self.main_branch().git().checkout()
+    def ahead_behind(self, branches):
+        """Count the commits of branches ahead / behind the main branch."""
+        main = self.main_ref()
+        git_repo = self.git()
+        ret = {}
+        if not branches:
+            return ret
+        if git_repo.git.version_info >= (2, 41):
+            counts = {}
+            for line in git_repo.git.for_each_ref(
+                f"--format=%(refname) %(ahead-behind:{main})",
+                *(f"refs/remotes/{branch.name}" for branch in branches),
+            ).splitlines():
+                ref, ahead, behind = line.split()
+                counts[ref.removeprefix("refs/remotes/")] = (int(ahead), int(behind))
+            for branch in branches:
+                if branch.name in counts:
+                    ret[branch] = counts[branch.name]
+            return ret
+        for branch in branches:
+            try:
+                behind, ahead = git_repo.git.rev_list(
+                    "--left-right",
+                    "--count",
+                    f"{main}...refs/remotes/{branch}",
+                ).split()
+            except git.exc.GitCommandError:
+                continue
+            ret[branch] = (int(ahead), int(behind))
+        return ret
+
+    def update_ahead_behind(self, branches=None):
+        if branches is None:
+            branches = self.branch_set.filter(deleted=False)
+        try:
+            counts = self.ahead_behind(branches)
+        except Branch.DoesNotExist:
+            return
+        for branch, (ahead, behind) in counts.items():
+            branch.ahead, branch.behind = ahead, behind
+        Branch.objects.bulk_update(counts, ["ahead", "behind"])
 
     def main_branch(self):
         return self.main_repo().main_branch()
 
+    def main_ref(self):
+        """Get the remote-tracking ref of the main branch: fetch doesn't move heads."""
+        return f"refs/remotes/{self.main_branch()}"
+
+    def create_remote(self, name, url):
+        """Add a remote, which is a blobless promisor if RAINBOARD_GIT_BLOBLESS."""
+        remote = self.git().create_remote(name, url)
+        if settings.RAINBOARD_GIT_BLOBLESS:
+            set_blobless(remote)
+        return remote
+
+    def main_blob(self, name):
+        """Get a file of the main branch from the object store, or None."""
+        try:
+            return self.git().commit(self.main_ref()).tree / name
+        except (
+            AttributeError,
+            KeyError,
+            ValueError,
+            git.exc.GitCommandError,
+            Branch.DoesNotExist,
+        ):
+            return None
+
     def cmake(self):
-        filename = self.git_path() / "CMakeLists.txt"
-        if not filename.exists():
+        blob = self.main_blob("CMakeLists.txt")
+        if blob is None or blob.hexsha == self.cmakelists_sha:
             return
-        with filename.open() as f:
-            content = f.read()
+        content = blob.data_stream.read().decode(errors="replace")
         for key, value in CMAKE_FIELDS.items():
             search = re.search(
                 rf"set\s*\(\s*project_{key}\s+([^)]+)*\)",
@@ -423,16 +835,14 @@ class Project(Links, NamedModel, TimeStampedModel):
                 if not dependency.cmake:
                     dependency.cmake = True
                     dependency.save()
+        self.cmakelists_sha = blob.hexsha
+        self.save(update_fields=["cmakelists_sha"])
 
     def ros(self):
-        try:
-            filename = self.git_path() / "package.xml"
-        except TypeError:
-            return
-        if not filename.exists():
+        blob = self.main_blob("package.xml")
+        if blob is None or blob.hexsha == self.package_xml_sha:
             return
-        with filename.open() as f:
-            content = f.read()
+        content = blob.data_stream.read().decode(errors="replace")
         for dependency in re.findall(
             r"<run_depend>(\w+).*</run_depend>",
             content,
@@ -447,6 +857,8 @@ class Project(Links, NamedModel, TimeStampedModel):
                 if not dependency.ros:
                     dependency.ros = True
                     dependency.save()
+        self.package_xml_sha = blob.hexsha
+        self.save(update_fields=["package_xml_sha"])
 
     def repos(self):
         return self.repo_set.count()
@@ -454,14 +866,20 @@ class Project(Links, NamedModel, TimeStampedModel):
     def rpkgs(self):
         return self.robotpkg_set.count()
 
-    def update_tags(self):
-        for tag in self.git().tags:
-            Tag.objects.get_or_create(name=str(tag), project=self)
+    def update_tags(self, tags=None):
+        if tags is None:
+            _, tags = self.git_refs()
+        existing = set(self.tag_set.values_list("name", flat=True))
+        Tag.objects.bulk_create(
+            Tag(name=name, project=self) for name in tags.keys() - existing
+        )
+        self.tag_set.filter(name__in=existing - tags.keys()).delete()
 
     def update_repo(self):
         branch = str(self.main_branch()).split("/", maxsplit=2)[2]
-        self.git().head.commit = (
-            self.git().remotes[self.main_repo().git_remote()].refs[branch].commit
+        git_repo = self.git()
+        git_repo.head.commit = (
+            git_repo.remotes[self.main_repo().git_remote()].refs[branch].commit
         )
 
     def main_gitlab_repo(self):
@@ -475,26 +893,15 @@ class Project(Links, NamedModel, TimeStampedModel):
         r.get_jobs_gitlab()
         r.get_builds_gitlab()
 
-    def update(self, only_main_branches=True):
+    def update(self, only_main_branches=True, metadata=True, branches=True):
         if self.main_namespace is None:
             return
-        self.update_branches(main=only_main_branches)
-        self.update_tags()
+        refs, tag_shas = self.git_refs()
+        if branches:
+            self.update_branches(main=only_main_branches, refs=refs)
+        self.update_tags(tag_shas)
         self.update_repo()
-        tags = self.tag_set.filter(
-            name__startswith="v",
-        )  # TODO: implement SQL ordering for semver
-        if tags.exists():
-            releases = []
-            for tag in tags:
-                try:
-                    release = tuple(int(v) for v in tag.name[1:].split("."))
-                    releases.append(release)
-                except ValueError:
-                    pass
-            if releases:
-                vmaj, vmin, vpatch = sorted(releases)[-1]
-                self.version = f"{vmaj}.{vmin}.{vpatch}"
+        self.update_version()
         robotpkg = self.robotpkg_set.order_by("-updated").first()
         branch = self.branch_set.order_by("-updated").first()
         branch_updated = branch is not None and branch.updated is not None
@@ -507,17 +914,64 @@ class Project(Links, NamedModel, TimeStampedModel):
             else:
                 self.updated = max(branch.updated, robotpkg.updated)
         self.ci_jobs()
-        self.checkout()
+        self.save()
+        self.update_commits_since()
+        if metadata:
+            self.update_metadata()
+
+    def update_version(self):
+        tags = self.tag_set.filter(
+            name__startswith="v",
+        )  # TODO: implement SQL ordering for semver
+        releases = []
+        for tag in tags:
+            try:
+                release = tuple(int(v) for v in tag.name[1:].split("."))
+                releases.append(release)
+            except ValueError:
+                pass
+        if releases:
+            vmaj, vmin, vpatch = sorted(releases)[-1]
+            self.version = f"{vmaj}.{vmin}.{vpatch}"
+
+    def update_metadata(self):
+        if self.main_namespace is None:
+            return
         self.cmake()
         self.ros()
-        self.save()
 
-    def commits_since(self):
+    def find_robotpkgs(self, index, ros2=True):
+        names = []
+        for slug in dict.fromkeys([self.slug, self.slug.replace("_", "-")]):
+            names += [f"{slug}{self.suffix}", f"py-{slug}{self.suffix}"]
+            if ros2:
+                names.append(f"{slug}{self.suffix}-ros2")
+        return [(category, name) for name in names for category in index.get(name, ())]
+
+    def update_commits_since(self):
+        """Count the commits since the release, if the main or tag moved."""
         try:
-            commits = self.git().git.rev_list(f"v{self.version}..{self.main_branch()}")
-            return len(commits.split("\n")) if commits else 0
-        except git.exc.GitCommandError:
-            pass
+            main_ref = self.main_ref()
+        except (AttributeError, Branch.DoesNotExist):
+            head = tag = None
+        else:
+            tag_ref = f"refs/tags/v{self.version}"
+            refs = self.git().git.for_each_ref(
+                "--format=%(refname) %(objectname)",
+                main_ref,
+                tag_ref,
+            )
+            shas = dict(line.split() for line in refs.splitlines())
+            head, tag = shas.get(main_ref), shas.get(tag_ref)
+        key, count = "", None
+        if head is not None and tag is not None:
+            key = f"{head} {tag}"
+            if key == self.commits_since_key:
+                return
+            count = int(self.git().git.rev_list("--count", f"{tag}..{head}"))
+        if (key, count) != (self.commits_since_key, self.commits_since):
+            self.commits_since_key, self.commits_since = key, count
+            self.save(update_fields=["commits_since_key", "commits_since"])
 
     def open_issues(self):
         return query_sum(self.repo_set, "open_issues")
@@ -530,13 +984,42 @@ class Project(Links, NamedModel, TimeStampedModel):
 
     def contributors(self, update=False):
         if update:
-            for guy in self.git().git.shortlog("-nse").split("\n"):
-                name, mail = guy[7:-1].split(" <")
-                contributor = get_contributor(name, mail)
-                contributor.projects.add(self)
-                contributor.save()
+            self.update_contributors()
         return self.contributor_set.all()
 
+    def shortlog(self, rev):
+        return [
+            re.match(r"\s*\d+\t(.*) <(.*)>$", line).groups()
+            for line in self.git().git.shortlog("-nse", rev).splitlines()
+        ]
+
+    def update_contributors(self, full=False):
+        """Add the authors of the main branch, since the last run unless full."""
+        head = self.git().commit(self.main_ref()).hexsha
+        if head == self.contributors_sha and not full:
+            return
+        rev = head
+        if self.contributors_sha and not full:
+            rev = f"{self.contributors_sha}..{head}"
+        try:
+            pairs = self.shortlog(rev)
+        except git.exc.GitCommandError:
+            if rev == head:
+                raise
+            # the last processed commit is gone, eg. after a force push
+            pairs = self.shortlog(head)
+        resolver = ContributorResolver(pairs)
+        contributors = resolver.save()
+        Contributor.projects.through.objects.bulk_create(
+            [
+                Contributor.projects.through(contributor=contributor, project=self)
+                for contributor in contributors
+            ],
+            ignore_conflicts=True,
+        )
+        self.contributors_sha = head
+        self.save(update_fields=["contributors_sha"])
+
     def registry(self):
         return settings.PUBLIC_REGISTRY if self.public else settings.PRIVATE_REGISTRY
 
@@ -701,12 +1184,7 @@ class Repo(TimeStampedModel):
             page,
         )
         try:
-            return httpx.get(
-                self.api_url() + url,
-                params={"page": page},
-                verify=self.forge.verify,
-                headers=self.forge.headers(),
-            )
+            return self.forge.api_get(self.api_url() + url, page)
         except httpx.HTTPError:
             logger.error(
                 "requesting api %s %s %s %s, page %d - SECOND TRY",
@@ -716,21 +1194,16 @@ class Repo(TimeStampedModel):
                 url,
                 page,
             )
-            return httpx.get(
-                self.api_url() + url,
-                params={"page": page},
-                verify=self.forge.verify,
-                headers=self.forge.headers(),
-            )
+            return self.forge.api_get(self.api_url() + url, page)
 
     def api_data(self, url=""):
         req = self.api_req(url)
         return req.json() if req.status_code == 200 else []  # TODO
 
-    def api_list(self, url="", name=None, limit=None):
-        page = 1
+    def api_list(self, url="", name=None, limit=None, concurrency=None):
+        page, reqs = 1, []
         while page:
-            req = self.api_req(url, name, page)
+            req = reqs.pop(0) if reqs else self.api_req(url, name, page)
             if req.status_code != 200:
                 return []  # TODO
             data = req.json()
@@ -743,6 +1216,14 @@ class Repo(TimeStampedModel):
             page = api_next(self.forge.source, req)
             if limit is not None and page is not None and page > limit:
                 break
+            if concurrency and page == 2:
+                reqs = api_gather(
+                    self.forge,
+                    self.api_url() + url,
+                    req,
+                    limit,
+                    concurrency,
+                )
 
     def api_update(self):
         data = self.api_data()
@@ -789,25 +1270,20 @@ class Repo(TimeStampedModel):
             return git_repo.remote(remote)
         except ValueError:
             logger.info("Creating remote %s", remote)
-            return git_repo.create_remote(remote, self.get_clone_url())
+            return self.project.create_remote(remote, self.get_clone_url())
 
     def fetch(self):
-        git_repo = self.git()
-        logger.debug("fetching %s / %s / %s", self.forge, self.namespace, self.project)
-        try:
-            git_repo.fetch()
-        except git.exc.GitCommandError:
-            logger.warning(
-                "fetching %s / %s / %s - SECOND TRY",
-                self.forge,
-                self.namespace,
-                self.project,
-            )
-            try:
-                git_repo.fetch()
-            except git.exc.GitCommandError:
-                return False
-        return True
+        """Fetch this remote, and return True on success."""
+        self.git()
+        remote = self.git_remote()
+        if FetchRun.active is not None:
+            return remote not in self.project.fetch()
+        git_repo = self.project.git()
+        failed = self.project.fetch_remotes(git_repo, [remote])
+        if failed:
+            logger.warning("fetching %s - SECOND TRY", self)
+            failed = self.project.fetch_remotes(git_repo, [remote])
+        return not failed
 
     def main_branch(self):
         return self.project.branch_set.get(
@@ -826,124 +1302,129 @@ class Repo(TimeStampedModel):
         return getattr(self, f"get_builds_{self.forge.get_source_display().lower()}")()
 
     def get_builds_gitlab(self):
-        for pipeline in self.api_list("/pipelines", limit=2):
-            pid, ref = pipeline["id"], pipeline["ref"]
-            if self.project.tag_set.filter(name=ref).exists():
-                continue
-            data = self.api_data(f"/pipelines/{pid}")
-            branch_name = f"{self.forge.slug}/{self.namespace.slug}/{ref}"
-            branch, created = Branch.objects.get_or_create(
-                name=branch_name,
-                project=self.project,
-                repo=self,
-            )
-            if created:
-                branch.update()
-            ci_build, created = CIBuild.objects.get_or_create(
-                repo=self,
-                build_id=pid,
-                defaults={
-                    "passed": GITLAB_STATUS[pipeline["status"]],
-                    "started": parse_datetime(data["created_at"]),
-                    "branch": branch,
-                },
-            )
-            if not created and ci_build.passed != GITLAB_STATUS[pipeline["status"]]:
-                ci_build.passed = GITLAB_STATUS[pipeline["status"]]
-                ci_build.save()
+        pipelines = list(self.api_list("/pipelines", limit=2))
+        branches = self.ci_branches(pipeline["ref"] for pipeline in pipelines)
+        CIBuild.objects.bulk_create(
+            [
+                CIBuild(
+                    repo=self,
+                    build_id=pipeline["id"],
+                    passed=GITLAB_STATUS[pipeline["status"]],
+                    started=parse_datetime(pipeline["created_at"]),
+                    branch=branches[pipeline["ref"]],
+                )
+                for pipeline in pipelines
+                if pipeline["ref"] in branches
+            ],
+            update_conflicts=True,
+            unique_fields=["repo", "build_id"],
+            update_fields=["passed"],
+        )
 
     def get_jobs_gitlab(self):
-        for data in self.api_list("/jobs", limit=4):
-            branch_name = f"{self.forge.slug}/{self.namespace.slug}/{data['ref']}"
-            branch, created = Branch.objects.get_or_create(
-                name=branch_name,
-                project=self.project,
-                repo=self,
-            )
-            if created:
-                branch.update()
-            ci_job, created = CIJob.objects.get_or_create(
-                repo=self,
-                job_id=data["id"],
-                defaults={
-                    "passed": GITLAB_STATUS[data["status"]],
-                    "started": parse_datetime(data["created_at"]),
-                    "branch": branch,
-                },
-            )
-            if not created and ci_job.passed != GITLAB_STATUS[data["status"]]:
-                ci_job.passed = GITLAB_STATUS[data["status"]]
-                ci_job.save()
-            if self == self.project.main_repo():
-                if data["name"] == "format":
-                    if (
-                        self.project.allow_format_failure
-                        and GITLAB_STATUS[data["status"]]
-                    ):
-                        self.project.allow_format_failure = False
-                        self.project.save()
-                        print(" format success", data["web_url"])
-                elif data["name"].startswith("robotpkg-"):
-                    py3 = "-py3" in data["name"]
-                    debug = "-debug" in data["name"]
-                    target = next(
-                        target
-                        for target in Target.objects.all()
-                        if target.name in data["name"]
-                    ).name
-                    robotpkg = data["name"][
-                        9 : -(3 + len(target) + (5 if debug else 7) + (3 if py3 else 0))
-                    ]  # shame.
-                    images = Image.objects.filter(
-                        robotpkg__name=robotpkg,
-                        target__name=target,
-                    )
-                    if not images.exists():
-                        continue
-                    image = images.first()
-                    if image.allow_failure and GITLAB_STATUS[data["status"]]:
-                        image.allow_failure = False
-                        image.save()
-                        print("  success", data["web_url"])
+        jobs = list(self.api_list("/jobs", limit=4))
+        # jobs on tags are recorded too, as on a branch of the tag name
+        branches = self.ci_branches((data["ref"] for data in jobs), with_tags=True)
+        CIJob.objects.bulk_create(
+            [
+                CIJob(
+                    repo=self,
+                    job_id=data["id"],
+                    passed=GITLAB_STATUS[data["status"]],
+                    started=parse_datetime(data["created_at"]),
+                    branch=branches[data["ref"]],
+                )
+                for data in jobs
+                if data["ref"] in branches
+            ],
+            update_conflicts=True,
+            unique_fields=["repo", "job_id"],
+            update_fields=["passed"],
+        )
+        if self != self.project.main_repo():
+            return
+        targets = list(Target.objects.all())
+        for data in jobs:
+            if data["name"] == "format":
+                if self.project.allow_format_failure and GITLAB_STATUS[data["status"]]:
+                    self.project.allow_format_failure = False
+                    self.project.save()
+                    print(" format success", data["web_url"])
+            elif data["name"].startswith("robotpkg-"):
+                if not GITLAB_STATUS[data["status"]]:
+                    continue
+                py3 = "-py3" in data["name"]
+                debug = "-debug" in data["name"]
+                target = next(
+                    target for target in targets if target.name in data["name"]
+                ).name
+                robotpkg = data["name"][
+                    9 : -(3 + len(target) + (5 if debug else 7) + (3 if py3 else 0))
+                ]  # shame.
+                image = Image.objects.filter(
+                    robotpkg__name=robotpkg,
+                    target__name=target,
+                ).first()
+                if image is not None and image.allow_failure:
+                    image.allow_failure = False
+                    image.save()
+                    print("  success", data["web_url"])
 
     def get_builds_github(self):
-        if self.travis_id is not None:
-            travis = Forge.objects.get(source=SOURCES.travis)
+        if self.travis_id is None:
+            return
+        travis = Forge.objects.get(source=SOURCES.travis)
+        builds = [
+            build
             for build in travis.api_list(
                 f"/repo/{self.travis_id}/builds",
                 name="builds",
-            ):
-                if (
-                    build["branch"] is None
-                    or self.project.tag_set.filter(
-                        name=build["branch"]["name"],
-                    ).exists()
-                ):
-                    continue
-                branch_name = (
-                    f"{self.forge.slug}/{self.namespace.slug}/{build['branch']['name']}"
-                )
-                branch, created = Branch.objects.get_or_create(
-                    name=branch_name,
-                    project=self.project,
-                    repo=self,
-                )
-                if created:
-                    branch.update()
-                started = (
-                    build["started_at"]
-                    if build["started_at"] is not None
-                    else build["finished_at"]
-                )
-                CIBuild.objects.get_or_create(
+            )
+            if build["branch"] is not None
+        ]
+        branches = self.ci_branches(build["branch"]["name"] for build in builds)
+        CIBuild.objects.bulk_create(
+            [
+                CIBuild(
                     repo=self,
                     build_id=build["id"],
-                    defaults={
-                        "passed": TRAVIS_STATE[build["state"]],
-                        "started": parse_datetime(started),
-                        "branch": branch,
-                    },
+                    passed=TRAVIS_STATE[build["state"]],
+                    started=parse_datetime(
+                        build["started_at"]
+                        if build["started_at"] is not None
+                        else build["finished_at"],
+                    ),
+                    branch=branches[build["branch"]["name"]],
                 )
+                for build in builds
+                if build["branch"]["name"] in branches
+            ],
+            update_conflicts=True,
+            unique_fields=["repo", "build_id"],
+            update_fields=["passed"],
+        )
+
+    def ci_branches(self, refs, with_tags=False):
+        """Map the refs of CI builds to their branches, creating the missing ones."""
+        refs = set(refs)
+        if not with_tags:
+            tags = self.project.tag_set.filter(name__in=refs)
+            refs -= set(tags.values_list("name", flat=True))
+        names = {ref: f"{self.forge.slug}/{self.namespace.slug}/{ref}" for ref in refs}
+        branches = {
+            branch.name: branch
+            for branch in self.branch_set.filter(
+                project=self.project,
+                name__in=names.values(),
+            )
+        }
+        for branch in Branch.objects.bulk_create(
+            Branch(name=name, project=self.project, repo=self)
+            for name in set(names.values()) - set(branches)
+        ):
+            branch.update()
+            branches[branch.name] = branch
+        return {ref: branches[name] for ref, name in names.items()}
 
     def update(self, pull=True):
         ok = True
@@ -1018,38 +1499,23 @@ class Branch(TimeStampedModel):
     class Meta:
         unique_together = ("project", "name", "repo")
 
-    def get_ahead(self, branch="master"):
-        commits = self.project.git().git.rev_list(f"{branch}..{self}")
-        return len(commits.split("\n")) if commits else 0
-
-    def get_behind(self, branch="master"):
-        commits = self.project.git().git.rev_list(f"{self}..{branch}")
-        return len(commits.split("\n")) if commits else 0
-
     def git(self):
-        git_repo = self.project.git()
-        if self.name not in git_repo.branches:
-            remote = self.repo.git()
-            _, _, branch = self.name.split("/", maxsplit=2)
-            git_repo.create_head(self.name, remote.refs[branch]).set_tracking_branch(
-                remote.refs[branch],
-            )
-        return git_repo.branches[self.name]
+        _, _, branch = self.name.split("/", maxsplit=2)
+        return self.repo.git().refs[branch]
 
-    def update(self, pull=True):
+    def update(self, pull=True, ahead_behind=True):
         if self.deleted:
             return
         try:
             if pull:
-                self.repo.fetch()
-                if self.repo != self.project.main_repo():
-                    self.project.main_repo().fetch()
-            try:
-                main_branch = self.project.main_branch()
-                self.ahead = self.get_ahead(main_branch)
-                self.behind = self.get_behind(main_branch)
-            except Branch.DoesNotExist:
-                pass
+                self.project.fetch()
+            if ahead_behind:
+                try:
+                    counts = self.project.ahead_behind([self])
+                    if self in counts:
+                        self.ahead, self.behind = counts[self]
+                except Branch.DoesNotExist:
+                    pass
             self.updated = self.git().commit.authored_datetime
         except (git.exc.GitCommandError, IndexError):
             self.deleted = True
@@ -1124,6 +1590,8 @@ class Robotpkg(NamedModel):
     updated = models.DateTimeField(blank=True, null=True)
 
     same_py = models.BooleanField(default=True)
+    tree_sha = models.CharField(max_length=81, blank=True, default="")
+    depends = models.JSONField(default=list, blank=True)
 
     extended_target = models.ManyToManyField(Target, blank=True)
 
@@ -1142,45 +1610,48 @@ class Robotpkg(NamedModel):
 
     def update(self, pull=True):
         path = settings.RAINBOARD_RPKG
-        repo = git.Repo(
-            str(path / "wip" / ".git" if self.category == "wip" else path / ".git"),
-        )
         if pull:
+            repo = git.Repo(
+                str(path / "wip" / ".git" if self.category == "wip" else path / ".git"),
+            )
             repo.remotes.origin.pull()
 
-        cwd = path / self.category / self.name
-        if not cwd.is_dir():
+        metadata = introspect_robotpkg(
+            path,
+            self.category,
+            self.name,
+            RPKG_VARNAMES,
+            self.tree_sha,
+        )
+        if metadata is None:
             logger.warning("deleted %s: %s", self, self.delete())
             return
-        for field in RPKG_FIELDS:
-            cmd = ["make", "show-var", f"VARNAME={field}"]
-            self.__dict__[field.lower()] = check_output(cmd, cwd=cwd).decode().strip()
-
-        repo_path = (
-            self.name if self.category == "wip" else f"{self.category}/{self.name}"
-        )
-        last_commit = next(repo.iter_commits(paths=repo_path, max_count=1))
-        self.updated = last_commit.authored_datetime
+        if self.apply(metadata):
+            self.save()
+        self.update_images()
 
-        lic = (
-            check_output(["make", "show-var", "VARNAME=LICENSE"], cwd=cwd)
-            .decode()
-            .strip()
-        )
+    def apply(self, metadata, licenses=None):
+        """Set the fields read by introspect_robotpkg, and return True if changed."""
+        if metadata["tree_sha"] == self.tree_sha:
+            return False
+        values = metadata["values"]
+        self.tree_sha = metadata["tree_sha"]
+        for field in RPKG_FIELDS:
+            self.__dict__[field.lower()] = values[field]
+        self.updated = metadata["updated"]
+        lic = values["LICENSE"]
         if lic in RPKG_LICENSES:
-            self.license = License.objects.get(spdx_id=RPKG_LICENSES[lic])
+            spdx_id = RPKG_LICENSES[lic]
+            if licenses is None:
+                self.license = License.objects.get(spdx_id=spdx_id)
+            else:
+                self.license = licenses[spdx_id]
         else:
             logger.warning("Unknown robotpkg license: %s", lic)
-        self.public = not bool(
-            check_output(["make", "show-var", "VARNAME=RESTRICTED"], cwd=cwd)
-            .decode()
-            .strip(),
-        )
-        with (cwd / "DESCR").open() as f:
-            self.description = f.read().strip()
-
-        self.update_images()
-        self.save()
+        self.public = not values["RESTRICTED"]
+        self.description = metadata["description"]
+        self.depends = metadata["depends"]
+        return True
 
     def valid_images(self):
         return (
@@ -1275,18 +1746,19 @@ class Image(models.Model):
         headers = {}
         if not self.robotpkg.project.public:
             image_name = self.get_image_name().split("/", maxsplit=1)[1].split(":")[0]
-            token = httpx.get(
-                f"{self.robotpkg.project.main_forge.url}/jwt/auth",
+            forge = self.robotpkg.project.main_forge
+            auth = forge.client().get(
+                f"{forge.url}/jwt/auth",
                 params={
                     "client_id": "docker",
                     "offline_token": True,
                     "service": "container_registry",
                     "scope": f"repository:{image_name}:push,pull",
                 },
-                auth=("gsaurel", self.robotpkg.project.main_forge.token),
-            ).json()["token"]
-            headers["Authorization"] = f"Bearer {token}"
-        r = httpx.get(self.get_image_url(), headers=headers)
+                auth=("gsaurel", forge.token),
+            )
+            headers["Authorization"] = f"Bearer {auth.json()['token']}"
+        r = get_client("registry").get(self.get_image_url(), headers=headers)
         if r.status_code == 200:
             self.image = r.json()["fsLayers"][0]["blobSum"].split(":")[1][:12]
             self.created = parse_datetime(
@@ -1311,6 +1783,7 @@ class CIBuild(models.Model):
 
     class Meta:
         ordering = ("-started",)
+        unique_together = ("repo", "build_id")
 
     def __str__(self):
         return f"{self.repo} - {self.build_id}"
@@ -1334,6 +1807,7 @@ class CIJob(models.Model):
 
     class Meta:
         ordering = ("-started",)
+        unique_together = ("repo", "job_id")
 
     def __str__(self):
         return f"{self.repo} / {self.job_id}"
@@ -1436,6 +1910,245 @@ class Dependency(models.Model):
         return f"{self.project} dep on {self.library}: {self.robotpkg:d} {self.cmake:d}"
 
 
+def get_client(key, verify=True):
+    """Get a pooled HTTP/2 client, shared by key."""
+    with HTTP_CLIENTS_LOCK:
+        if key not in HTTP_CLIENTS:
+            HTTP_CLIENTS[key] = httpx.Client(http2=True, verify=verify)
+        return HTTP_CLIENTS[key]
+
+
+def close_clients():
+    with HTTP_CLIENTS_LOCK:
+        for client in HTTP_CLIENTS.values():
+            client.close()
+        HTTP_CLIENTS.clear()
+
+
+atexit.register(close_clients)
+
+
+class FetchRun:
+    """Fetch each project at most once, with at most jobs git fetch at once."""
+
+    active = None
+
+    def __init__(self, jobs=None):
+        self.fetched = {}
+        self.lock = threading.Lock()
+        self.semaphore = threading.BoundedSemaphore(
+            jobs or settings.RAINBOARD_FETCH_JOBS,
+        )
+
+    def __enter__(self):
+        FetchRun.active = self
+        return self
+
+    def __exit__(self, *args):
+        FetchRun.active = None
+
+
+def fetch_projects(projects, jobs=None):
+    """Fetch projects concurrently, and return {project: exception} on failure."""
+    with ThreadPoolExecutor(max_workers=jobs or settings.RAINBOARD_FETCH_JOBS) as ex:
+        futures = {
+            project: ex.submit(
+                workers.run,
+                f"fetch {project}",
+                project.pk,
+                project.fetch,
+            )
+            for project in projects
+        }
+    return {
+        project: future.result()
+        for project, future in futures.items()
+        if future.result() is not None
+    }
+
+
+def update_robotpkgs(robotpkgs, jobs=None, errors=None):
+    """Introspect robotpkg packages in a process pool, and save them in bulk."""
+    robotpkgs = list(robotpkgs)
+    licenses = License.objects.in_bulk(RPKG_LICENSES.values(), field_name="spdx_id")
+    changed, deleted, existing = [], [], []
+    if errors is None:
+        errors = {}
+    with ProcessPoolExecutor(
+        max_workers=jobs or settings.RAINBOARD_RPKG_JOBS,
+        mp_context=multiprocessing.get_context("forkserver"),
+    ) as executor:
+        futures = {
+            executor.submit(
+                introspect_robotpkg,
+                settings.RAINBOARD_RPKG,
+                robotpkg.category,
+                robotpkg.name,
+                RPKG_VARNAMES,
+                robotpkg.tree_sha,
+            ): robotpkg
+            for robotpkg in robotpkgs
+        }
+        for future in as_completed(futures):
+            robotpkg = futures[future]
+            try:
+                metadata = future.result()
+                if metadata is not None and robotpkg.apply(metadata, licenses):
+                    changed.append(robotpkg)
+            except Exception as e:
+                logger.exception("update of %s failed", robotpkg)
+                errors[robotpkg.pk] = e
+                continue
+            (existing if metadata is not None else deleted).append(robotpkg)
+    for robotpkg in deleted:
+        logger.warning("deleted %s", robotpkg)
+    Robotpkg.objects.filter(pk__in=[robotpkg.pk for robotpkg in deleted]).delete()
+    Robotpkg.objects.bulk_update(changed, RPKG_UPDATE_FIELDS)
+    return existing
+
+
+def git_repos():
+    if not hasattr(GIT_REPOS, "cache"):
+        GIT_REPOS.cache = OrderedDict()
+    return GIT_REPOS.cache
+
+
+def set_blobless(remote):
+    """Make a remote a promisor, which fetches commits and trees but no blob."""
+    with remote.config_writer as config:
+        config.set("promisor", "true")
+        config.set("partialclonefilter", "blob:none")
+
+
+def get_git(path, init=False):
+    """Get an open git repository from a per-thread LRU cache."""
+    key = str(path)
+    repos = git_repos()
+    repo = repos.pop(key, None)
+    if repo is None or init or not (path / ".git").is_dir():
+        repo = git.Repo.init(path) if init else git.Repo(str(path / ".git"))
+    repos[key] = repo
+    while len(repos) > settings.RAINBOARD_GIT_CACHE_SIZE:
+        repos.popitem(last=False)
+    return repo
+
+
+def close_gits():
+    repos = git_repos()
+    for repo in repos.values():
+        repo.close()
+    repos.clear()
+
+
+atexit.register(close_gits)
+
+
+def api_gather(forge, url, first, limit, concurrency):
+    """Fetch the pages of a listing after the first one, concurrently."""
+    last = api_last(forge.source, first)
+    if last is None:
+        return []
+    if limit is not None:
+        last = min(last, limit)
+    logger.debug("requesting api %s %s, pages 2 to %d", forge, url, last)
+    keys = [api_cache_key(url, page) for page in range(2, last + 1)]
+    conditions = api_cache_conditions(keys)
+
+    scheduler = forge.scheduler()
+
+    async def get(client, semaphore, key):
+        async with semaphore:
+            while True:
+                await asyncio.to_thread(scheduler.acquire)
+                try:
+                    req = await client.get(key, headers=conditions.get(key, {}))
+                except httpx.HTTPError:
+                    logger.error("requesting api %s %s - SECOND TRY", forge, key)
+                    req = await client.get(key, headers=conditions.get(key, {}))
+                if not scheduler.update_from(req):
+                    return req
+
+    async def gather():
+        semaphore = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(
+            http2=True,
+            verify=forge.verify,
+            headers=forge.headers(),
+        ) as client:
+            return await asyncio.gather(
+                *(get(client, semaphore, key) for key in keys),
+            )
+
+    return [
+        api_cache_response(key, req) or forge.api_get(key, page)
+        for page, key, req in zip(
+            range(2, last + 1),
+            keys,
+            asyncio.run(gather()),
+            strict=True,
+        )
+    ]
+
+
+def api_cache_key(url, page):
+    return str(httpx.URL(url).copy_merge_params({"page": page}))
+
+
+def api_cache_conditions(keys):
+    return {
+        cache.url: cache.conditions() for cache in ApiCache.objects.filter(url__in=keys)
+    }
+
+
+def api_cache_response(key, req):
+    """Store a fresh API response, or get the cached one on 304, if any."""
+    if req.status_code == 304:
+        cache = ApiCache.objects.filter(url=key).first()
+        if cache is None:
+            return None
+        cache.save(update_fields=["used"])
+        return httpx.Response(
+            200,
+            headers=cache.headers,
+            content=bytes(cache.content),
+            request=req.request,
+        )
+    if req.status_code != 200:
+        return req
+    etag = req.headers.get("ETag", "")
+    last_modified = req.headers.get("Last-Modified", "")
+    if not etag and not last_modified:
+        return req
+    _, created = ApiCache.objects.update_or_create(
+        url=key,
+        defaults={
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": {
+                header: req.headers[header]
+                for header in API_CACHE_HEADERS
+                if header in req.headers
+            },
+            "content": req.content,
+        },
+    )
+    if created and next(API_CACHE_INSERTS) % API_CACHE_EVICT_EVERY == 0:
+        api_cache_evict()
+    return req
+
+
+def api_cache_evict():
+    if ApiCache.objects.count() > settings.RAINBOARD_API_CACHE_SIZE:
+        evicted = ApiCache.objects.order_by("-used").values_list("pk", flat=True)[
+            settings.RAINBOARD_API_CACHE_SIZE :
+        ]
+        ApiCache.objects.filter(pk__in=list(evicted)).delete()
+
+
+def is_main_branch(name):
+    return any(name.endswith(main) for main in MAIN_BRANCHES)
+
+
 def get_default_forge(project):
     for forge in Forge.objects.order_by("source"):
         if project.repo_set.filter(forge=forge).exists():
@@ -1496,7 +2209,33 @@ def update_gitlab(forge, data):
     repo.save()
 
 
-def update_github(forge, namespace, data):
+def github_graphql_repo(node):
+    """Convert a repository from GitHub's GraphQL API to the REST API format."""
+    open_issues = node["issues"]["totalCount"] + node["pullRequests"]["totalCount"]
+    data = {
+        "id": node["databaseId"],
+        "name": node["name"],
+        "archived": node["isArchived"],
+        "homepage": node["homepageUrl"],
+        "html_url": node["url"],
+        "clone_url": f"{node['url']}.git",
+        "default_branch": (node["defaultBranchRef"] or {"name": "master"})["name"],
+        "description": node["description"],
+        "open_issues": open_issues,
+        "open_issues_count": open_issues,
+        "open_pr": node["pullRequests"]["totalCount"],
+        "license": node["licenseInfo"] and {"spdx_id": node["licenseInfo"]["spdxId"]},
+    }
+    # like "source" in the REST API, the root of the fork network, unless deeper
+    fork = node["parent"]
+    while fork and fork.get("parent"):
+        fork = fork["parent"]
+    if fork and not fork.get("isFork"):
+        data["source"] = {"id": fork["databaseId"]}
+    return data
+
+
+def update_github(forge, namespace, data, repo_data=None):
     if data["archived"]:
         return
     logger.info("update %s from %s", data["name"], forge)
@@ -1525,31 +2264,41 @@ def update_github(forge, namespace, data):
     repo.open_issues = data["open_issues"]
     repo.description = data["description"] or ""
 
-    repo_data = repo.api_data()
-    if repo_data and "license" in repo_data and repo_data["license"]:
-        if "spdx_id" in repo_data["license"] and repo_data["license"]["spdx_id"]:
-            if repo_data["license"]["spdx_id"] != "NOASSERTION":
-                try:
-                    lic = License.objects.get(
-                        spdx_id=repo_data["license"]["spdx_id"],
-                    )
-                except License.DoesNotExist as e:
-                    raise ValueError(
-                        "No License with spdx_id=" + repo_data["license"]["spdx_id"],
-                    ) from e
-                repo.license = lic
-                if not project.license:
-                    project.license = lic
-        if "source" in repo_data:
-            repo.forked_from = repo_data["source"]["id"]
+    if repo_data is None:
+        repo_data = repo.api_data()
+    update_github_license(repo, project, repo_data)
     if repo_data:
         repo.open_issues = repo_data["open_issues_count"]
     repo.clone_url = data["clone_url"]
-    repo.open_pr = len(list(repo.api_list("/pulls")))
+    update_github_open_pr(repo, repo_data)
     repo.save()
     project.save()
 
 
+def update_github_license(repo, project, repo_data):
+    if not repo_data or not repo_data.get("license"):
+        return
+    spdx_id = repo_data["license"].get("spdx_id")
+    if spdx_id and spdx_id != "NOASSERTION":
+        try:
+            lic = License.objects.get(spdx_id=spdx_id)
+        except License.DoesNotExist as e:
+            raise ValueError("No License with spdx_id=" + spdx_id) from e
+        repo.license = lic
+        if not project.license:
+            project.license = lic
+    if "source" in repo_data:
+        repo.forked_from = repo_data["source"]["id"]
+
+
+def update_github_open_pr(repo, repo_data):
+    if "open_pr" in repo_data:
+        repo.open_pr = repo_data["open_pr"]
+    else:
+        pulls = repo.api_list("/pulls", concurrency=settings.RAINBOARD_API_CONCURRENCY)
+        repo.open_pr = len(list(pulls))
+
+
 def update_travis(namespace, data):
     project = Project.objects.filter(name=valid_name(data["name"])).first()
     if project is None:
@@ -1568,52 +2317,208 @@ def update_travis(namespace, data):
         repo.save()
 
 
-def merge_contributors(*contributors):
-    logger.warning("merging %s", contributors)
-    ids = [contributor.id for contributor in contributors]
-    main = min(ids)
-    for model in (ContributorName, ContributorMail):
-        for instance in model.objects.filter(contributor_id__in=ids):
-            instance.contributor_id = main
-            instance.save()
-    Contributor.objects.filter(id__in=ids).exclude(id=main).delete()
-    return Contributor.objects.get(id=main)
+def merge_contributors(dropped):
+    """Merge contributors in bulk, given as {dropped pk: kept contributor}."""
+    if not dropped:
+        return
+    logger.warning("merging %s contributors", len(dropped))
+    groups = defaultdict(list)
+    for pk, keep in dropped.items():
+        groups[keep].append(pk)
+    signed = set(
+        Contributor.objects.filter(
+            pk__in=dropped,
+            agreement_signed=True,
+        ).values_list("pk", flat=True),
+    )
+    for keep, pks in groups.items():
+        for model in (ContributorName, ContributorMail):
+            model.objects.filter(contributor_id__in=pks).update(contributor=keep)
+        if signed.intersection(pks) and not keep.agreement_signed:
+            keep.agreement_signed = True
+            keep.save(update_fields=["agreement_signed"])
+    through = Contributor.projects.through
+    through.objects.bulk_create(
+        [
+            through(
+                contributor=dropped[link.contributor_id],
+                project_id=link.project_id,
+            )
+            for link in through.objects.filter(contributor_id__in=dropped)
+        ],
+        ignore_conflicts=True,
+    )
+    Contributor.objects.filter(pk__in=dropped).delete()
 
 
-def get_contributor(name, mail):
-    cname, name_created = ContributorName.objects.get_or_create(name=name)
-    cmail, mail_created = ContributorMail.objects.get_or_create(
-        mail=mail,
-        defaults={"invalid": invalid_mail(mail)},
-    )
-    if name_created or mail_created:
-        if name_created and mail_created:
-            contributor = Contributor.objects.create()
-            cname.contributor = contributor
-            cmail.contributor = contributor
-            cname.save()
-            cmail.save()
-        if mail_created:
-            contributor = cname.contributor
-            cmail.contributor = contributor
-            cmail.save()
-        if name_created:
-            contributor = cmail.contributor
-            cname.contributor = cmail.contributor
-            cname.save()
-    elif cname.contributor == cmail.contributor or invalid_mail(mail):
-        contributor = cname.contributor
-    elif cname.contributor is None and cmail.contributor is not None:
-        contributor = cmail.contributor
-        cname.contributor = contributor
-        cname.save()
-    elif cmail.contributor is None:
-        contributor = cname.contributor
-        cmail.contributor = contributor
-        cmail.save()
-    else:
-        contributor = merge_contributors(cname.contributor, cmail.contributor)
-    return contributor
+class ContributorResolver:
+    """Resolve (name, mail) pairs to contributors in memory, then save()."""
+
+    def __init__(self, pairs):
+        self.pairs = list(dict.fromkeys(pairs))
+        self.names = {
+            cname.name: cname
+            for cname in ContributorName.objects.filter(
+                name__in={name for name, _ in self.pairs},
+            ).select_related("contributor")
+        }
+        self.mails = {
+            cmail.mail: cmail
+            for cmail in ContributorMail.objects.filter(
+                mail__in={mail for _, mail in self.pairs},
+            ).select_related("contributor")
+        }
+        self.contributors, self.new, self.changed = [], [], []
+        self.dropped = {}
+        for name, mail in self.pairs:
+            self.resolve(name, mail)
+
+    def resolve(self, name, mail):
+        cname, cmail = self.names.get(name), self.mails.get(mail)
+        if cname is not None and cmail is not None:
+            if cname.contributor == cmail.contributor or invalid_mail(mail):
+                return
+            if cname.contributor is not None and cmail.contributor is not None:
+                self.merge(cname.contributor, cmail.contributor)
+                return
+        contributor = next(
+            (c.contributor for c in (cname, cmail) if c and c.contributor),
+            None,
+        )
+        if contributor is None:
+            contributor = Contributor()
+            self.contributors.append(contributor)
+        for instance in (cname, cmail):
+            if instance is not None and instance.contributor is None:
+                instance.contributor = contributor
+                self.changed.append(instance)
+        if cname is None:
+            self.names[name] = ContributorName(name=name, contributor=contributor)
+            self.new.append(self.names[name])
+        if cmail is None:
+            self.mails[mail] = ContributorMail(
+                mail=mail,
+                contributor=contributor,
+                invalid=invalid_mail(mail),
+            )
+            self.new.append(self.mails[mail])
+
+    def merge(self, first, second):
+        """Merge two contributors, either of which may not be saved yet."""
+        saved = [c for c in (first, second) if c.pk is not None]
+        keep = min(saved, key=lambda c: c.pk) if saved else second
+        for drop in (first, second):
+            if drop is keep or (drop.pk is not None and drop.pk == keep.pk):
+                continue
+            if drop.pk is not None:
+                for pk, kept in self.dropped.items():
+                    if kept.pk == drop.pk:
+                        self.dropped[pk] = keep
+                self.dropped[drop.pk] = keep
+            for instance in [*self.names.values(), *self.mails.values()]:
+                if instance.contributor is drop or (
+                    drop.pk is not None and instance.contributor_id == drop.pk
+                ):
+                    instance.contributor = keep
+            if drop in self.contributors:
+                self.contributors.remove(drop)
+
+    def save(self):
+        """Write the changes, and return the contributors of the pairs."""
+        Contributor.objects.bulk_create(self.contributors)
+        merge_contributors(self.dropped)
+        for model in (ContributorName, ContributorMail):
+            model.objects.bulk_create(i for i in self.new if isinstance(i, model))
+            model.objects.bulk_update(
+                [i for i in self.changed if isinstance(i, model)],
+                ["contributor"],
+            )
+        return {self.names[name].contributor for name, _ in self.pairs} - {None}
+
+
+class IdentityResolver:
+    """Resolve all the contributors identities at once, with a union-find."""
+
+    def __init__(self, pairs, mailmaps=()):
+        self.names = {cname.name: cname for cname in ContributorName.objects.all()}
+        self.mails = {cmail.mail: cmail for cmail in ContributorMail.objects.all()}
+        self.sets = UnionFind()
+        for kind, instances in (("name", self.names), ("mail", self.mails)):
+            for key, instance in instances.items():
+                self.sets.add((kind, key))
+                if instance.contributor_id is not None:
+                    contributor = ("contributor", instance.contributor_id)
+                    self.sets.union((kind, key), contributor)
+        for name, mail in pairs:
+            self.sets.add(("name", name))
+            if not invalid_mail(mail) or ("mail", mail) not in self.sets.parent:
+                self.sets.union(("name", name), ("mail", mail))
+        for names, mails in mailmaps:
+            nodes = [("name", name) for name in names]
+            nodes += [
+                ("mail", mail)
+                for mail in mails
+                if not invalid_mail(mail) or ("mail", mail) not in self.sets.parent
+            ]
+            for node in nodes:
+                self.sets.union(nodes[0], node)
+        self.contributors = Contributor.objects.in_bulk()
+        self.new, self.changed, self.signed = [], [], []
+        self.dropped, self.resolved = {}, {}
+        for group in self.sets.groups():
+            self.partition(group)
+
+    def partition(self, group):
+        """Give the same contributor to all the names and mails of a group."""
+        ids = sorted(key for kind, key in group if kind == "contributor")
+        if ids:
+            keep = self.contributors[ids[0]]
+        else:
+            keep = Contributor()
+            self.new.append(keep)
+        for pk in ids[1:]:
+            self.dropped[pk] = keep
+            if self.contributors[pk].agreement_signed and not keep.agreement_signed:
+                keep.agreement_signed = True
+                self.signed.append(keep)
+        for kind, key in group:
+            if kind == "name":
+                self.resolved[key] = keep
+                instance = self.names.setdefault(key, ContributorName(name=key))
+            elif kind == "mail":
+                instance = self.mails.setdefault(
+                    key,
+                    ContributorMail(mail=key, invalid=invalid_mail(key)),
+                )
+            else:
+                continue
+            if keep.pk is None or instance.contributor_id != keep.pk:
+                instance.contributor = keep
+                self.changed.append(instance)
+
+    def save(self):
+        """Write the partition in bulk, and return the contributors by name."""
+        if self.dropped:
+            logger.warning("merging %s contributors", len(self.dropped))
+        Contributor.objects.bulk_create(self.new)
+        Contributor.objects.bulk_update(self.signed, ["agreement_signed"])
+        for model in (ContributorName, ContributorMail):
+            instances = [i for i in self.changed if isinstance(i, model)]
+            model.objects.bulk_create(i for i in instances if i.pk is None)
+            model.objects.bulk_update([i for i in instances if i.pk], ["contributor"])
+        through = Contributor.projects.through
+        through.objects.bulk_create(
+            [
+                through(
+                    contributor=self.dropped[link.contributor_id],
+                    project_id=link.project_id,
+                )
+                for link in through.objects.filter(contributor_id__in=self.dropped)
+            ],
+            ignore_conflicts=True,
+        )
+        Contributor.objects.filter(pk__in=self.dropped).delete()
+        return self.resolved
 
 
 def unvalid_projects():
@@ -1639,45 +2544,30 @@ def to_release_in_robotpkg():
 
 def ordered_projects():
     """helper for gepetto/buildfarm/generate_all.py"""
-    fields = "category", "name", "project__main_namespace__slug"
+    fields = "category", "name", "project__main_namespace__slug", "depends"
 
     projects = Project.objects.from_gepetto()
     rpkgs = list(Robotpkg.objects.filter(project__in=projects).values_list(*fields))
-
-    deps_cache = {}
-
-    def get_deps(cat, pkg, ns, rpkgs):
-        """Get the robotpkg dependencies for a given robotpkg."""
-        with (settings.RAINBOARD_RPKG / cat / pkg / "Makefile").open() as file_handle:
-            cont = file_handle.read()
-        deps = [
-            d_pkg
-            for d_cat, d_pkg, _ in rpkgs
-            if f"\ninclude ../../{d_cat}/{d_pkg}/depend.mk\n" in cont
-        ]
-        if pkg.startswith("py-") and (cat, pkg[3:], ns) in rpkgs:
-            deps.append(pkg[3:])
-        deps_cache[pkg] = sorted(set(deps))
-        return deps_cache[pkg]
-
-    rpkgs = [[cat, pkg, ns, get_deps(cat, pkg, ns, rpkgs)] for cat, pkg, ns in rpkgs]
-
-    def get_rdeps(deps):
-        """Recursively get robotpkg dependencies for a given robotpkg."""
-        rdeps = set()
-        current = set(deps)
-        while current:
-            rdeps |= current
-            new = set()
-            for dep in current:
-                new |= set(deps_cache[dep])
-            current = new
-        return rdeps
-
-    def project_sort_key(prj):
-        """Generate a key to sort projects: by number of recursive dependencies,
-        then python bindings, then name."""
-        _cat, pkg, _ns, deps = prj
-        return (len(get_rdeps(deps)), 1 if pkg.startswith("py-") else 0, pkg)
-
-    return sorted(rpkgs, key=project_sort_key)
+    by_path = defaultdict(list)
+    for cat, pkg, ns, _depends in rpkgs:
+        by_path[f"{cat}/{pkg}"].append((cat, pkg, ns))
+
+    graph = {}
+    for cat, pkg, ns, depends in rpkgs:
+        deps = [dep for path in depends for dep in by_path[path] if dep[1] != pkg]
+        if pkg.startswith("py-") and (cat, pkg[3:], ns) in by_path[f"{cat}/{pkg[3:]}"]:
+            deps.append((cat, pkg[3:], ns))
+        graph[cat, pkg, ns] = deps
+
+    levels = topological_levels(graph)
+    if cycle := [node for node in graph if node not in levels]:
+        logger.warning("robotpkg dependency cycle in %s", cycle)
+
+    def project_sort_key(node):
+        _cat, pkg, _ns = node
+        return (levels.get(node, len(graph)), 1 if pkg.startswith("py-") else 0, pkg)
+
+    return [
+        [*node, sorted({dep_pkg for _, dep_pkg, _ in graph[node]})]
+        for node in sorted(graph, key=project_sort_key)
+    ]
@@ -0,0 +1,132 @@
+"""Pace the requests made to the forges APIs according to their rate limits."""
+
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger("rainboard.ratelimit")
+
+BATCH, WEBHOOK = 0, 1
+PRIORITY = contextvars.ContextVar("priority", default=BATCH)
+REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining")
+RESET_HEADERS = ("X-RateLimit-Reset", "RateLimit-Reset")
+SCHEDULERS = {}
+SCHEDULERS_LOCK = threading.Lock()
+
+
+@contextmanager
+def priority(level):
+    """Run the requests made in this context with a given priority."""
+    token = PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        PRIORITY.reset(token)
+
+
+def get_scheduler(key):
+    """Get the process-wide scheduler of an API, identified by its url."""
+    with SCHEDULERS_LOCK:
+        if key not in SCHEDULERS:
+            SCHEDULERS[key] = Scheduler(key)
+        return SCHEDULERS[key]
+
+
+class Scheduler:
+    """
+    Token bucket refilled from the rate limit headers sent by a forge.
+
+    The requests remaining in the current window are spread until its reset.
+    Batch requests leave RAINBOARD_RATELIMIT_RESERVE of them to webhook-driven
+    requests, and everyone sleeps until the reset when nothing is left.
+    """
+
+    def __init__(self, key, burst=10):
+        self.key = key
+        self.burst = burst
+        self.remaining = None
+        self.reset = 0.0
+        self.tokens = float(burst)
+        self.refilled = time.time()
+        self.condition = threading.Condition()
+
+    def __str__(self):
+        return self.key
+
+    def delay(self, level):
+        """Seconds to wait before the next request, or 0."""
+        now = time.time()
+        if self.remaining is None or now >= self.reset:
+            self.remaining = None
+            return 0
+        available = self.remaining
+        if level == BATCH:
+            available -= settings.RAINBOARD_RATELIMIT_RESERVE
+        if available <= 0:
+            return self.reset - now
+        if level == WEBHOOK:
+            return 0
+        rate = available / (self.reset - now)
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * rate)
+        self.refilled = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / rate
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        level = PRIORITY.get()
+        with self.condition:
+            while (delay := self.delay(level)) > 0:
+                if delay > 1:
+                    logger.warning("%s rate limited, sleeping %.0fs", self, delay)
+                self.condition.wait(delay)
+            if self.remaining is not None:
+                self.remaining -= 1
+                if level == BATCH:
+                    self.tokens -= 1
+
+    def update(self, remaining, reset):
+        """Learn the state of the rate limit window from the forge."""
+        with self.condition:
+            self.remaining, self.reset = remaining, reset
+            self.condition.notify_all()
+
+    def update_from(self, response):
+        """
+        Read the rate limit headers of a response.
+
+        Return True if the request was rejected because of the rate limit,
+        in which case it must be sent again.
+        """
+        headers = response.headers
+        remaining = next((headers[h] for h in REMAINING_HEADERS if h in headers), None)
+        reset = next((headers[h] for h in RESET_HEADERS if h in headers), None)
+        limited = response.status_code == 429 or (
+            response.status_code == 403 and remaining == "0"
+        )
+        if limited:
+            remaining = 0
+            if reset is None or "Retry-After" in headers:
+                reset = time.time() + int(headers.get("Retry-After", 60))
+        if remaining is not None and reset is not None:
+            self.update(int(remaining), float(reset))
+        return limited
+
+
+class ScheduledSession(requests.Session):
+    """Requests session going through a Scheduler, eg. for python-gitlab."""
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, *args, **kwargs):
+        while True:
+            self.scheduler.acquire()
+            response = super().request(*args, **kwargs)
+            if not self.scheduler.update_from(response):
+                return response
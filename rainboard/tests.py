@@ -1,9 +1,16 @@
 import doctest
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from unittest import mock
 
-from django.test import TestCase
+import git
+import httpx
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 
-from . import models, utils
+from . import models, ratelimit, utils, workers
 from .models import IssuePr, Repo
 
 
@@ -11,7 +18,7 @@ class RainboardTests(TestCase):
     def test_utils(self):
         failure_count, test_count = doctest.testmod(utils)
         self.assertEqual(failure_count, 0)
-        self.assertEqual(test_count, 5)
+        self.assertEqual(test_count, 7)
 
     def test_models(self):
         license_count = models.License.objects.count()
@@ -103,3 +110,326 @@ class RainboardTests(TestCase):
             '<a href="https://github.com">issue #7</a>',
         ]:
             self.assertIn(chunk, content)
+
+
+class WorkersTests(TransactionTestCase):
+    def graph(self, calls, **kwargs):
+        """a -> b -> c, d alone, and f which fails -> e."""
+
+        def task(name):
+            def func():
+                calls.append(name)
+                if name == "f":
+                    raise ValueError(name)
+
+            return func
+
+        graph = workers.Graph(lambda message: None, **kwargs)
+        a = graph.add("a", task("a"))
+        b = graph.add("b", task("b"), after=[a])
+        graph.add("c", task("c"), after=[b])
+        graph.add("d", task("d"))
+        f = graph.add("f", task("f"))
+        graph.add("e", task("e"), after=[f])
+        return graph
+
+    def test_graph(self):
+        calls = []
+        update_run = models.UpdateRun.objects.create()
+        graph = self.graph(calls, update_run=update_run)
+        graph.run(4)
+
+        self.assertEqual(sorted(calls), ["a", "b", "c", "d", "f"])
+        self.assertLess(calls.index("a"), calls.index("b"))
+        self.assertLess(calls.index("b"), calls.index("c"))
+        self.assertEqual([label for label, _ in graph.errors()], ["f"])
+        self.assertEqual([task.label for task in graph.skipped()], ["e"])
+
+        tasks = {task.key: task for task in update_run.updatetask_set.all()}
+        self.assertEqual(sorted(tasks), ["a", "b", "c", "d", "e", "f"])
+        self.assertEqual(
+            {key for key, task in tasks.items() if task.passed},
+            {"a", "b", "c", "d"},
+        )
+        self.assertIn("ValueError", tasks["f"].error)
+        self.assertEqual(tasks["e"].error, "skipped after a failure")
+
+    def test_resume(self):
+        self.graph([], update_run=models.UpdateRun.objects.create()).run(1)
+        done = models.UpdateTask.objects.passed_since(5).values_list("key", flat=True)
+
+        calls = []
+        graph = self.graph(calls, done=done)
+        graph.run(1)
+        self.assertEqual(calls, ["f"])
+        self.assertEqual(
+            sorted(task.label for task in graph.tasks if task.resumed),
+            ["a", "b", "c", "d"],
+        )
+        self.assertEqual([task.label for task in graph.skipped()], ["e"])
+
+
+class ContributorsTests(TestCase):
+    def test_union_find(self):
+        sets = utils.UnionFind()
+        sets.union("a", "b")
+        sets.union("c", "d")
+        sets.union("b", "d")
+        sets.add("e")
+        self.assertEqual(sets.find("a"), sets.find("c"))
+        self.assertNotEqual(sets.find("a"), sets.find("e"))
+        self.assertEqual(
+            sorted(sorted(group) for group in sets.groups()),
+            [["a", "b", "c", "d"], ["e"]],
+        )
+
+    def test_parse_mailmap(self):
+        content = "# comment\n\n<jd@a.org> <j@b.org>\nJ D <jd@a.org> # old\n"
+        self.assertEqual(
+            utils.parse_mailmap(content),
+            [([], ["jd@a.org", "j@b.org"]), (["J D"], ["jd@a.org"])],
+        )
+
+    def test_contributor_resolver(self):
+        project = models.Project.objects.create(
+            name="Rainboard Contributors Tests",
+            main_namespace=models.Namespace.objects.get(slug="gepetto"),
+        )
+        jane = models.Contributor.objects.create()
+        jane.contributorname_set.create(name="Jane Doe")
+        jd = models.Contributor.objects.create(agreement_signed=True)
+        jd.contributormail_set.create(mail="jd@b.org")
+        jd.contributorname_set.create(name="J. D.")
+        jd.projects.add(project)
+        pairs = [
+            ("Jane Doe", "jd@b.org"),
+            ("Bob", "bob@c.org"),
+            ("Alice", "jd@b.org"),
+            ("Bob", "root@localhost"),
+            ("Jane Doe", "root@localhost"),
+        ]
+        contributors = models.ContributorResolver(pairs).save()
+
+        self.assertFalse(models.Contributor.objects.filter(pk=jd.pk).exists())
+        jane.refresh_from_db()
+        self.assertTrue(jane.agreement_signed)
+        self.assertEqual(list(jane.projects.all()), [project])
+        self.assertEqual(
+            sorted(jane.contributorname_set.values_list("name", flat=True)),
+            ["Alice", "J. D.", "Jane Doe"],
+        )
+        # an invalid mail must not merge unrelated people
+        self.assertEqual(len(contributors), 2)
+
+    def test_identity_resolver(self):
+        jane = models.Contributor.objects.create()
+        jane.contributorname_set.create(name="Jane Doe")
+        jd = models.Contributor.objects.create(agreement_signed=True)
+        jd.contributormail_set.create(mail="jd@b.org")
+        pairs = [
+            ("Jane Doe", "jane@a.org"),
+            ("J. D.", "jd@b.org"),
+            ("Alice", "root@localhost"),
+            ("Bob", "root@localhost"),
+        ]
+        mailmaps = [
+            (["Jane Doe"], ["jane@a.org", "jd@b.org"]),
+            (["Carol"], ["root@localhost"]),
+        ]
+        resolved = models.IdentityResolver(pairs, mailmaps).save()
+
+        self.assertEqual(resolved["Jane Doe"], jane)
+        self.assertEqual(resolved["J. D."], jane)
+        self.assertFalse(models.Contributor.objects.filter(pk=jd.pk).exists())
+        jane.refresh_from_db()
+        self.assertTrue(jane.agreement_signed)
+        self.assertEqual(
+            sorted(jane.contributormail_set.values_list("mail", flat=True)),
+            ["jane@a.org", "jd@b.org"],
+        )
+        # an invalid mail must not merge unrelated people
+        self.assertEqual(len({resolved[name] for name in ("Alice", "Bob", "Carol")}), 3)
+        root = models.ContributorMail.objects.get(mail="root@localhost")
+        self.assertTrue(root.invalid)
+        self.assertEqual(root.contributor, resolved["Alice"])
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.forge = models.Forge.objects.get(source=utils.SOURCES.github)
+        self.requests, self.evict = [], False
+        transport = httpx.MockTransport(self.handler)
+        key = f"forge-{self.forge.pk}"
+        models.HTTP_CLIENTS[key] = httpx.Client(transport=transport)
+        self.addCleanup(models.HTTP_CLIENTS.pop, key)
+        patch = mock.patch.object(
+            httpx,
+            "AsyncClient",
+            partial(httpx.AsyncClient, transport=transport),
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def handler(self, request):
+        """Serve 3 pages of 2 items, with an ETag, and honor If-None-Match."""
+        self.requests.append(request)
+        page = int(request.url.params.get("page", 1))
+        if request.headers.get("If-None-Match") == f'"{page}"':
+            if self.evict:
+                models.ApiCache.objects.all().delete()
+            return httpx.Response(304)
+        last = f'<{request.url.copy_set_param("page", 3)}>; rel="last"'
+        link = f'<{request.url.copy_set_param("page", page + 1)}>; rel="next", {last}'
+        return httpx.Response(
+            200,
+            json=[2 * page - 1, 2 * page],
+            headers={"ETag": f'"{page}"', "Link": link if page < 3 else ""},
+        )
+
+    def test_api_cache(self):
+        url = "https://api.github.com/orgs/gepetto/repos"
+        self.assertEqual(self.forge.api_get(url).json(), [1, 2])
+        self.assertEqual(models.ApiCache.objects.get().etag, '"1"')
+
+        response = self.forge.api_get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [1, 2])
+        self.assertEqual(self.requests[-1].headers["If-None-Match"], '"1"')
+
+        # the cached response is evicted while the conditional request is sent
+        self.evict = True
+        self.assertEqual(self.forge.api_get(url).json(), [1, 2])
+        self.assertEqual(len(self.requests), 4)
+        self.assertNotIn("If-None-Match", self.requests[-1].headers)
+
+    def test_api_list(self):
+        url = "/orgs/gepetto/repos"
+        self.assertEqual(list(self.forge.api_list(url)), [*range(1, 7)])
+        self.assertEqual(list(self.forge.api_list(url, concurrency=2)), [*range(1, 7)])
+        self.assertEqual(models.ApiCache.objects.count(), 3)
+        # the pages gathered concurrently are conditional requests too
+        self.assertEqual(
+            sorted(
+                request.headers.get("If-None-Match") for request in self.requests[3:]
+            ),
+            ['"1"', '"2"', '"3"'],
+        )
+
+
+class SchedulerTests(TestCase):
+    @override_settings(RAINBOARD_RATELIMIT_RESERVE=100)
+    def test_delay(self):
+        scheduler = ratelimit.Scheduler("test")
+        self.assertEqual(scheduler.delay(ratelimit.BATCH), 0)
+
+        scheduler.update(50, time.time() + 60)
+        self.assertGreater(scheduler.delay(ratelimit.BATCH), 50)
+        self.assertEqual(scheduler.delay(ratelimit.WEBHOOK), 0)
+
+        scheduler.update(1100, time.time() + 100)
+        scheduler.tokens, scheduler.refilled = 0, time.time()
+        self.assertAlmostEqual(scheduler.delay(ratelimit.BATCH), 0.1, delta=0.01)
+
+    def test_update_from(self):
+        scheduler = ratelimit.Scheduler("test")
+        reset = time.time() + 60
+        ok = httpx.Response(
+            200,
+            headers={"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": str(reset)},
+        )
+        self.assertFalse(scheduler.update_from(ok))
+        self.assertEqual((scheduler.remaining, scheduler.reset), (10, reset))
+
+        self.assertTrue(
+            scheduler.update_from(httpx.Response(429, headers={"Retry-After": "5"})),
+        )
+        self.assertEqual(scheduler.remaining, 0)
+        self.assertAlmostEqual(scheduler.reset, time.time() + 5, delta=1)
+
+
+class GitTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name)
+        self.upstream = git.Repo.init(self.path / "upstream", initial_branch="master")
+        with self.upstream.config_writer() as config:
+            config.set_value("user", "name", "Jane Doe")
+            config.set_value("user", "email", "jane@a.org")
+        self.commit("2020-01-01")
+        self.upstream.create_tag("v1.0.0")
+        self.upstream.create_head("devel")
+        self.commit("2020-01-02")
+        settings = override_settings(RAINBOARD_GITS=self.path / "gits")
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        gepetto = models.Namespace.objects.get(slug="gepetto")
+        github = models.Forge.objects.get(source=utils.SOURCES.github)
+        self.project = models.Project.objects.create(
+            name="Rainboard Git Tests",
+            main_namespace=gepetto,
+            main_forge=github,
+            version="1.0.0",
+        )
+        Repo.objects.create(
+            name="rainboard-git-tests",
+            forge=github,
+            namespace=gepetto,
+            project=self.project,
+            default_branch="master",
+            repo_id=0,
+            clone_url=str(self.path / "upstream"),
+        )
+
+    def commit(self, date, branch="master"):
+        self.upstream.git.symbolic_ref("HEAD", f"refs/heads/{branch}")
+        self.upstream.git.commit("--allow-empty", "-m", date, f"--date={date}T12:00Z")
+
+    def update(self):
+        self.project.fetch()
+        self.project.update_branches(main=False, pull=False)
+        self.project.update_ahead_behind()
+        return {
+            branch.name: branch
+            for branch in self.project.branch_set.filter(deleted=False)
+        }
+
+    def test_branches(self):
+        branches = self.update()
+        self.assertEqual(
+            sorted(branches),
+            ["github/gepetto/devel", "github/gepetto/master"],
+        )
+        devel = branches["github/gepetto/devel"]
+        self.assertEqual((devel.ahead, devel.behind), (0, 1))
+        self.assertEqual(devel.updated.date().isoformat(), "2020-01-01")
+        self.assertEqual(self.project.git().heads, [])
+
+        # upstream moves, and local heads of the same names must not matter
+        self.project.git().create_head("github/gepetto/devel", "v1.0.0")
+        self.commit("2020-02-01")
+        self.commit("2020-03-01", "devel")
+        self.commit("2020-03-02", "devel")
+        branches = self.update()
+        devel = branches["github/gepetto/devel"]
+        self.assertEqual((devel.ahead, devel.behind), (2, 2))
+        self.assertEqual(devel.updated.date().isoformat(), "2020-03-02")
+        master = branches["github/gepetto/master"]
+        self.assertEqual(master.updated.date().isoformat(), "2020-02-01")
+
+        self.commit("2020-04-01")
+        self.upstream.delete_head("devel", force=True)
+        self.assertNotIn("github/gepetto/devel", self.update())
+
+    def test_commits_since(self):
+        self.update()
+        self.project.update_commits_since()
+        self.assertEqual(self.project.commits_since, 1)
+        key = self.project.commits_since_key
+
+        self.commit("2020-02-01")
+        self.update()
+        self.project.update_commits_since()
+        self.assertEqual(self.project.commits_since, 2)
+        self.assertNotEqual(self.project.commits_since_key, key)
@@ -1,6 +1,10 @@
+import hashlib
 import logging
+import os
 import re
 import unicodedata
+from collections import defaultdict, deque
+from subprocess import check_output
 
 from django.db.models import IntegerChoices
 from django.utils.safestring import mark_safe
@@ -40,6 +44,19 @@ def api_next(source, req):
     return None
 
 
+def api_last(source, req):
+    """Get the number of the last page of a listing, if the forge provides it."""
+    if source == SOURCES.github:
+        for link in req.headers.get("Link", "").split(","):
+            if 'rel="last"' in link:
+                return int(re.search(r"[?&]page=(\d+)", link).group(1))
+    if source == SOURCES.gitlab:
+        if req.headers.get("X-Total-Pages"):
+            return int(req.headers["X-Total-Pages"])
+        return None
+    return None
+
+
 def domain(url):
     """
     Extracts the domain of an url
@@ -79,10 +96,165 @@ def update_robotpkg(path):
         git.Repo(str(path / "wip" / ".git")).remotes.origin.pull()
 
 
+def show_vars(path, names):
+    """
+    Get some variables of a robotpkg package, with a single make.
+
+    show-vars prints their values one per line, in the order of VARNAMES.
+    """
+    cmd = ["make", "show-vars", f"VARNAMES={' '.join(names)}"]
+    values = check_output(cmd, cwd=path).decode().splitlines()
+    if len(values) != len(names):
+        msg = f"make show-vars in {path}: {len(values)} lines for {len(names)} vars"
+        raise ValueError(msg)
+    return {name: value.strip() for name, value in zip(names, values, strict=True)}
+
+
+def robotpkg_index(path):
+    """Map the package names of a robotpkg tree to their categories, in one scan."""
+    index = defaultdict(list)
+    with os.scandir(path) as categories:
+        for category in categories:
+            if category.name.startswith(".") or not category.is_dir():
+                continue
+            with os.scandir(category.path) as packages:
+                for package in packages:
+                    if not package.name.startswith(".") and package.is_dir():
+                        index[package.name].append(category.name)
+    return index
+
+
+def introspect_robotpkg(path, category, name, varnames, tree_sha=""):
+    """
+    Read the metadata of a robotpkg package, without touching the database.
+
+    This runs in worker processes. Return None if the package was removed, or
+    only its "tree_sha" if it is the given one: the package directory, the
+    directories of the packages it includes and the mk infrastructure did not
+    change, so neither did the metadata.
+    """
+    cwd = path / category / name
+    if not cwd.is_dir():
+        return None
+    with (cwd / "Makefile").open() as f:
+        makefile = f.read()
+    repo_path = name if category == "wip" else f"{category}/{name}"
+    git_dir = path / "wip" / ".git" if category == "wip" else path / ".git"
+    trees, main_trees = [f"HEAD:{repo_path}"], ["HEAD:mk"]
+    includes = re.findall(
+        r"^include \.\./\.\./([^/\s]+/[^/\s]+)/",
+        makefile,
+        flags=re.MULTILINE,
+    )
+    for directory in dict.fromkeys(includes):
+        if not (path / directory).is_dir():
+            continue
+        if not directory.startswith("wip/"):
+            main_trees.append(f"HEAD:{directory}")
+        elif category == "wip":
+            trees.append(f"HEAD:{directory.removeprefix('wip/')}")
+    with git.Repo(str(path / ".git")) as main, git.Repo(str(git_dir)) as repo:
+        shas = (
+            repo.git.rev_parse(*trees).split() + main.git.rev_parse(*main_trees).split()
+        )
+        key = hashlib.sha1(" ".join(shas).encode(), usedforsecurity=False)
+        metadata = {"tree_sha": key.hexdigest()}
+        if metadata["tree_sha"] == tree_sha:
+            return metadata
+        last_commit = next(repo.iter_commits(paths=repo_path, max_count=1))
+        metadata["updated"] = last_commit.authored_datetime
+    metadata["values"] = show_vars(cwd, varnames)
+    metadata["depends"] = re.findall(
+        r"^include \.\./\.\./([^/\s]+/[^/\s]+)/depend\.mk$",
+        makefile,
+        flags=re.MULTILINE,
+    )
+    with (cwd / "DESCR").open() as f:
+        metadata["description"] = f.read().strip()
+    return metadata
+
+
+def topological_levels(graph):
+    """
+    Get the level of the nodes of a graph {node: prerequisites}, with Kahn's algorithm.
+
+    Nodes without prerequisites are at level 0, the others one level above their
+    highest prerequisite. Nodes in a cycle, or depending on one, are left out.
+
+    >>> topological_levels({'a': [], 'b': ['a'], 'c': ['a', 'b'], 'd': ['d']})
+    {'a': 0, 'b': 1, 'c': 2}
+    """
+    waiting = {node: len(set(prerequisites)) for node, prerequisites in graph.items()}
+    dependents = defaultdict(list)
+    for node, prerequisites in graph.items():
+        for prerequisite in set(prerequisites):
+            dependents[prerequisite].append(node)
+    levels = {node: 0 for node, count in waiting.items() if not count}
+    ready = deque(levels)
+    while ready:
+        node = ready.popleft()
+        for dependent in dependents[node]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                levels[dependent] = 1 + max(levels[p] for p in graph[dependent])
+                ready.append(dependent)
+    return levels
+
+
 def invalid_mail(mail):
     return any(invalid in mail for invalid in INVALID_MAILS)
 
 
+class UnionFind:
+    """Disjoint sets of hashable items, with path halving and union by size."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        self.add(item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            if self.size[first] < self.size[second]:
+                first, second = second, first
+            self.parent[second] = first
+            self.size[first] += self.size[second]
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return list(groups.values())
+
+
+def parse_mailmap(content):
+    """
+    Get the names and mails of each line of a .mailmap, as (names, mails).
+
+    >>> parse_mailmap('Jane Doe <jane@a.org> J. D. <jd@b.org>  # old mail')
+    [(['Jane Doe', 'J. D.'], ['jane@a.org', 'jd@b.org'])]
+    """
+    entries = []
+    for line in content.splitlines():
+        pairs = re.findall(r"([^<>#]*)<([^<>]+)>", line.split("#")[0])
+        if pairs:
+            names = [name.strip() for name, _ in pairs if name.strip()]
+            entries.append((names, [mail.strip() for _, mail in pairs]))
+    return entries
+
+
 def valid_name(name):
     """
     Replace dashes and underscores by spaces, and lowercase.
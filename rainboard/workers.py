@@ -0,0 +1,186 @@
+"""Run per-project work from a pool of threads, as a graph of tasks."""
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger("rainboard.workers")
+
+PROJECT_LOCKS = {}
+PROJECT_LOCKS_LOCK = threading.Lock()
+
+
+@contextmanager
+def project_lock(project_id):
+    """Prevent two threads from working on the same git checkout."""
+    with PROJECT_LOCKS_LOCK:
+        lock = PROJECT_LOCKS.setdefault(project_id, threading.Lock())
+    with lock:
+        yield
+
+
+def run(label, project_id, func):
+    """
+    Run func in a worker thread, holding the lock of its project if any.
+
+    Return None on success, or the exception which was raised.
+    """
+    close_old_connections()
+    try:
+        with nullcontext() if project_id is None else project_lock(project_id):
+            func()
+    except Exception as e:
+        logger.exception("%s failed", label)
+        return e
+    finally:
+        connection.close()
+    return None
+
+
+class Task:
+    """A unit of work, which can start once all its prerequisites succeeded."""
+
+    def __init__(self, label, func, project_id=None, after=(), key=None):
+        self.label = label
+        self.key = label if key is None else key
+        self.func = func
+        self.project_id = project_id
+        self.after = [task for task in after if task is not None]
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.skipped = False
+        self.resumed = False
+
+    def __str__(self):
+        return self.label
+
+    def run(self, update_run=None):
+        func = self.func
+        if update_run is not None:
+            func = update_run.track(self.key, self.label, func)
+        self.started = time.monotonic()
+        self.error = run(self.label, self.project_id, func)
+        self.finished = time.monotonic()
+
+    def failed(self):
+        return self.skipped or self.error is not None
+
+    def duration(self):
+        return 0 if self.started is None else self.finished - self.started
+
+
+class Graph:
+    """
+    Tasks and their prerequisites, run with at most jobs threads.
+
+    Ready tasks are started as soon as a thread is available, so that a slow
+    project only delays the tasks which depend on it. A task is skipped if one
+    of its prerequisites failed or was skipped.
+
+    The progress of the tasks is recorded in update_run, if given. Tasks whose
+    key is in done are considered successful without being run again.
+    """
+
+    def __init__(self, log=logger.info, update_run=None, done=()):
+        self.tasks = []
+        self.log = log
+        self.update_run = update_run
+        self.done = set(done)
+        self.waiting = {}
+        self.dependents = {}
+        self.started = None
+        self.finished = None
+
+    def add(self, label, func, project_id=None, after=(), key=None):
+        task = Task(label, func, project_id, after, key)
+        self.tasks.append(task)
+        return task
+
+    def run(self, jobs):
+        self.started = time.monotonic()
+        self.waiting = {task: set(task.after) for task in self.tasks}
+        self.dependents = {task: [] for task in self.tasks}
+        for task in self.tasks:
+            for prerequisite in task.after:
+                self.dependents[prerequisite].append(task)
+        ready = [task for task in self.tasks if not task.after]
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while ready or running:
+                finished = [task for task in ready if self.resume(task)]
+                for task in ready:
+                    if not task.resumed:
+                        self.log(f" {task}")
+                        running[executor.submit(task.run, self.update_run)] = task
+                if not finished:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    finished = [running.pop(future) for future in done]
+                ready = self.release(finished)
+        self.finished = time.monotonic()
+
+    def resume(self, task):
+        """Consider a task successful if it already was in a previous run."""
+        task.resumed = task.key in self.done
+        return task.resumed
+
+    def release(self, finished):
+        """
+        Get the tasks which are ready once some others finished.
+
+        Those with a failed prerequisite are skipped, and so are their dependents.
+        """
+        ready = []
+        while finished:
+            task = finished.pop()
+            for dependent in self.dependents[task]:
+                self.waiting[dependent].discard(task)
+                if self.waiting[dependent]:
+                    continue
+                if any(p.failed() for p in dependent.after):
+                    self.skip(dependent)
+                    finished.append(dependent)
+                else:
+                    ready.append(dependent)
+        return ready
+
+    def skip(self, task):
+        task.skipped = True
+        if self.update_run is not None:
+            self.update_run.updatetask_set.create(
+                key=task.key,
+                label=task.label,
+                passed=False,
+                error="skipped after a failure",
+            )
+
+    def errors(self):
+        return [(task.label, task.error) for task in self.tasks if task.error]
+
+    def skipped(self):
+        return [task for task in self.tasks if task.skipped]
+
+    def critical_path(self):
+        """The chain of tasks which ended last, from its first prerequisite."""
+        done = [task for task in self.tasks if task.finished is not None]
+        path = [max(done, key=lambda task: task.finished)] if done else []
+        while path and (after := [t for t in path[-1].after if t.finished]):
+            path.append(max(after, key=lambda task: task.finished))
+        return path[::-1]
+
+    def report(self, slowest=10):
+        self.log(f"\n{len(self.tasks)} tasks in {self.finished - self.started:.1f}s")
+        self.log("\nCritical path:")
+        for task in self.critical_path():
+            self.log(f" {task.duration():8.1f}s {task}")
+        self.log(f"\n{slowest} slowest tasks:")
+        for task in sorted(self.tasks, key=Task.duration, reverse=True)[:slowest]:
+            self.log(f" {task.duration():8.1f}s {task}")
+        if skipped := self.skipped():
+            self.log(f"\n{len(skipped)} tasks skipped after a failure")
+        if resumed := [task for task in self.tasks if task.resumed]:
+            self.log(f"\n{len(resumed)} tasks already done by a previous run")